@@ -0,0 +1,288 @@
+"""
+Review analytics for the admin dashboard
+
+Three rollup tables hold totals for each day of reviews.date:
+- daily_game_reviews: per game, its reviews, their total score and the helpful and
+  not helpful votes on them
+- daily_user_reviews: the same per reviewer
+- daily_review_scores: how many reviews gave each score from 1 to 10
+A review's votes count on the day of the review, not the day of the vote.
+
+Triggers on reviews and review_votes keep them up to date in the same transaction as
+every write, so the dashboard reads a few hundred rollup rows instead of scanning
+reviews, and weeks are summed from the days when they are shown. The dashboard reads
+on a read connection (see database.py), so it never holds up writers.
+
+A deleted review takes its votes off in a BEFORE DELETE trigger, as its votes are
+deleted (see schema.py) before its AFTER DELETE triggers run, and by then the vote
+triggers can no longer find which day and game they belonged to. Taking a review off
+deletes the rows it leaves with nothing in them, so the tables only hold days which
+had reviews.
+After bulk changes with the triggers missing use "flask rebuild-analytics".
+"""
+
+from datetime import date, timedelta
+import json
+
+
+# Dashboard ranges: (days in a bucket, number of buckets shown)
+PERIODS = {"day": (1, 30), "week": (7, 26)}
+TOP_LIMIT = 10
+
+ROLLUP_TABLES = [
+    ("daily_game_reviews", "game_id"),
+    ("daily_user_reviews", "user_id"),
+]
+
+# Adds sign (1 or -1) times review's score and votes to its day
+ADD_REVIEW = """
+    INSERT INTO {table} (day, {key}, num_reviews, total_score, helpful_votes, unhelpful_votes)
+    SELECT date({review}.date), {review}.{key}, {sign}, {sign} * {review}.score,
+        {sign} * (SELECT COUNT(*) FROM review_votes WHERE review_id = {review}.review_id AND vote > 0),
+        {sign} * (SELECT COUNT(*) FROM review_votes WHERE review_id = {review}.review_id AND vote < 0)
+    WHERE true
+    ON CONFLICT (day, {key}) DO UPDATE SET
+        num_reviews = num_reviews + excluded.num_reviews,
+        total_score = total_score + excluded.total_score,
+        helpful_votes = helpful_votes + excluded.helpful_votes,
+        unhelpful_votes = unhelpful_votes + excluded.unhelpful_votes;"""
+
+ADD_SCORE = """
+    INSERT INTO daily_review_scores (day, score, num_reviews)
+    VALUES (date({review}.date), {review}.score, {sign})
+    ON CONFLICT (day, score) DO UPDATE SET
+        num_reviews = num_reviews + excluded.num_reviews;"""
+
+# Adds sign times vote to the day of the review it is on, nothing if the review is gone
+ADD_VOTE = """
+    INSERT INTO {table} (day, {key}, num_reviews, total_score, helpful_votes, unhelpful_votes)
+    SELECT date(r.date), r.{key}, 0, 0, {sign} * ({vote}.vote > 0), {sign} * ({vote}.vote < 0)
+    FROM reviews AS r
+    WHERE r.review_id = {vote}.review_id
+    ON CONFLICT (day, {key}) DO UPDATE SET
+        helpful_votes = helpful_votes + excluded.helpful_votes,
+        unhelpful_votes = unhelpful_votes + excluded.unhelpful_votes;"""
+
+
+# Deletes review's rows once they are back to nothing, after it is taken off
+DROP_EMPTY = """
+    DELETE FROM {table}
+    WHERE day = date({review}.date) AND {key} = {review}.{key}
+    AND num_reviews = 0 AND helpful_votes = 0 AND unhelpful_votes = 0;"""
+
+DROP_EMPTY_SCORE = """
+    DELETE FROM daily_review_scores
+    WHERE day = date({review}.date) AND score = {review}.score AND num_reviews = 0;"""
+
+
+def add_review(review, sign):
+    sql = [ADD_REVIEW.format(table=table, key=key, review=review, sign=sign) for table, key in ROLLUP_TABLES]
+    sql.append(ADD_SCORE.format(review=review, sign=sign))
+    if sign < 0:
+        sql += [DROP_EMPTY.format(table=table, key=key, review=review) for table, key in ROLLUP_TABLES]
+        sql.append(DROP_EMPTY_SCORE.format(review=review))
+    return "".join(sql)
+
+
+def add_vote(vote, sign):
+    return "".join(ADD_VOTE.format(table=table, key=key, vote=vote, sign=sign) for table, key in ROLLUP_TABLES)
+
+
+ANALYTICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_game_reviews (
+    day DATE NOT NULL,
+    game_id INTEGER NOT NULL,
+    num_reviews INTEGER NOT NULL,
+    total_score INTEGER NOT NULL,
+    helpful_votes INTEGER NOT NULL,
+    unhelpful_votes INTEGER NOT NULL,
+    PRIMARY KEY (day, game_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_user_reviews (
+    day DATE NOT NULL,
+    user_id TEXT NOT NULL,
+    num_reviews INTEGER NOT NULL,
+    total_score INTEGER NOT NULL,
+    helpful_votes INTEGER NOT NULL,
+    unhelpful_votes INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_review_scores (
+    day DATE NOT NULL,
+    score INTEGER NOT NULL,
+    num_reviews INTEGER NOT NULL,
+    PRIMARY KEY (day, score)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS analytics_after_review_insert
+AFTER INSERT ON reviews
+BEGIN{new_review}
+END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_after_review_update
+AFTER UPDATE OF user_id, game_id, date, score ON reviews
+BEGIN{old_review_off}{new_review}
+END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_before_review_delete
+BEFORE DELETE ON reviews
+BEGIN{old_review_off}
+END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_after_vote_insert
+AFTER INSERT ON review_votes
+BEGIN{new_vote}
+END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_after_vote_update
+AFTER UPDATE OF vote ON review_votes
+BEGIN{old_vote_off}{new_vote}
+END;
+
+CREATE TRIGGER IF NOT EXISTS analytics_after_vote_delete
+AFTER DELETE ON review_votes
+BEGIN{old_vote_off}
+END;
+""".format(new_review=add_review("NEW", 1), old_review_off=add_review("OLD", -1),
+           new_vote=add_vote("NEW", 1), old_vote_off=add_vote("OLD", -1))
+
+
+# Triggers which took reviews off without deleting the rows they left empty
+OLD_TRIGGERS = ["analytics_after_review_update", "analytics_before_review_delete"]
+
+
+# Run after create_votes_table (see app.py)
+def create_analytics_tables(db):
+    old = db.execute("""SELECT name FROM sqlite_master
+                    WHERE type = 'trigger' AND sql NOT LIKE '%DELETE FROM daily_review_scores%'
+                    AND name IN (SELECT value FROM json_each(?));""", (json.dumps(OLD_TRIGGERS),)).fetchall()
+    for trigger in old:
+        db.execute("DROP TRIGGER " + trigger["name"] + ";")
+    if old != []:
+        # And the rows they left
+        delete_empty_rows(db)
+    db.executescript(ANALYTICS_SCHEMA)
+    # Fills the rollups the first time they are created on an existing database
+    empty = db.execute("""SELECT NOT EXISTS (SELECT 1 FROM daily_review_scores)
+                        AND EXISTS (SELECT 1 FROM reviews);""").fetchone()[0]
+    if empty:
+        rebuild_analytics(db)
+        db.commit()
+
+
+def delete_empty_rows(db):
+    for table, _ in ROLLUP_TABLES:
+        db.execute("DELETE FROM " + table + " WHERE num_reviews = 0 AND helpful_votes = 0 AND unhelpful_votes = 0;")
+    db.execute("""DELETE FROM daily_review_scores WHERE num_reviews = 0;""")
+
+
+def rebuild_analytics(db):
+    for table, key in ROLLUP_TABLES:
+        db.execute("DELETE FROM " + table + ";")
+        db.execute("INSERT INTO " + table + " (day, " + key + ", num_reviews, total_score, helpful_votes, unhelpful_votes)"
+                   + """ SELECT date(r.date), r.""" + key + """, COUNT(*), TOTAL(r.score),
+                        TOTAL(v.helpful), TOTAL(v.unhelpful)
+                    FROM reviews AS r
+                    LEFT JOIN (SELECT review_id, SUM(vote > 0) AS helpful, SUM(vote < 0) AS unhelpful
+                               FROM review_votes
+                               GROUP BY review_id) AS v
+                    ON v.review_id = r.review_id
+                    GROUP BY date(r.date), r.""" + key + """;""")
+    db.execute("""DELETE FROM daily_review_scores;""")
+    db.execute("""INSERT INTO daily_review_scores (day, score, num_reviews)
+                SELECT date(date), score, COUNT(*)
+                FROM reviews
+                GROUP BY date(date), score;""")
+
+
+# The first day of the bucket of period which day is in, weeks start on Monday
+def bucket_start(day, period):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+# The (first day, last day) of the range of period shown, ending with the bucket of the
+# latest review (or today if there are none)
+def dashboard_range(db, period):
+    days, num_buckets = PERIODS[period]
+    latest = db.execute("""SELECT MAX(day) FROM daily_review_scores WHERE num_reviews > 0;""").fetchone()[0]
+    latest = date.fromisoformat(latest) if latest is not None else date.today()
+    first = bucket_start(latest, period) - timedelta(days=days * (num_buckets - 1))
+    return first, latest
+
+
+# SQL for the first day of the bucket a day is in
+def bucket_sql(period):
+    if period == "week":
+        return "date(day, '-6 days', 'weekday 1')"
+    return "day"
+
+
+# Reviews, average score and votes for each bucket from first to last, oldest first
+# Buckets with no reviews are included, with zeros
+def review_volume(db, period, first, last):
+    rows = db.execute("""SELECT """ + bucket_sql(period) + """ AS bucket,
+                            TOTAL(num_reviews) AS num_reviews, TOTAL(total_score) AS total_score,
+                            TOTAL(helpful_votes) AS helpful_votes, TOTAL(unhelpful_votes) AS unhelpful_votes
+                        FROM daily_game_reviews
+                        WHERE day BETWEEN ? AND ?
+                        GROUP BY bucket;""", (first.isoformat(), last.isoformat())).fetchall()
+    # Days come back as dates, weeks as text
+    by_bucket = {str(row["bucket"]): row for row in rows}
+    days, _ = PERIODS[period]
+    volume = []
+    bucket = first
+    while bucket <= last:
+        row = by_bucket.get(bucket.isoformat())
+        num_reviews = int(row["num_reviews"]) if row is not None else 0
+        volume.append({
+            "bucket": bucket,
+            "num_reviews": num_reviews,
+            "avg_score": round(row["total_score"] / num_reviews, 1) if num_reviews > 0 else None,
+            "helpful_votes": int(row["helpful_votes"]) if row is not None else 0,
+            "unhelpful_votes": int(row["unhelpful_votes"]) if row is not None else 0,
+        })
+        bucket += timedelta(days=days)
+    return volume
+
+
+# How many reviews from first to last gave each score, from 1 to 10
+def score_distribution(db, first, last):
+    counts = dict(db.execute("""SELECT score, TOTAL(num_reviews)
+                            FROM daily_review_scores
+                            WHERE day BETWEEN ? AND ?
+                            GROUP BY score;""", (first.isoformat(), last.isoformat())).fetchall())
+    return [{"score": score, "num_reviews": int(counts.get(score, 0))} for score in range(1, 11)]
+
+
+# The games (or users, key "user_id") with most reviews from first to last
+def top_reviewed(db, table, key, first, last, limit=TOP_LIMIT):
+    return db.execute("SELECT " + key + """, TOTAL(num_reviews) AS num_reviews,
+                            TOTAL(total_score) / NULLIF(TOTAL(num_reviews), 0) AS avg_score,
+                            TOTAL(helpful_votes) AS helpful_votes, TOTAL(unhelpful_votes) AS unhelpful_votes
+                        FROM """ + table + """
+                        WHERE day BETWEEN ? AND ?
+                        GROUP BY """ + key + """
+                        HAVING TOTAL(num_reviews) > 0
+                        ORDER BY TOTAL(num_reviews) DESC
+                        LIMIT ?;""", (first.isoformat(), last.isoformat(), limit)).fetchall()
+
+
+# Everything the dashboard shows for period ("day" or "week")
+def dashboard(db, period):
+    first, last = dashboard_range(db, period)
+    top_games = top_reviewed(db, "daily_game_reviews", "game_id", first, last)
+    names = dict(db.execute("""SELECT game_id, name FROM games
+                            WHERE game_id IN (SELECT value FROM json_each(?));""",
+                            (json.dumps([game["game_id"] for game in top_games]),)).fetchall())
+    return {
+        "first": first,
+        "last": last,
+        "volume": review_volume(db, period, first, last),
+        "scores": score_distribution(db, first, last),
+        "top_games": [dict(game, name=names.get(game["game_id"])) for game in top_games],
+        "top_users": top_reviewed(db, "daily_user_reviews", "user_id", first, last),
+    }
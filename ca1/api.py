@@ -0,0 +1,137 @@
+"""
+JSON API, version 1, at /api/v1
+
+GET /api/v1/games                      games, ?order=release_date|name|avg_score, ?genre=
+GET /api/v1/games/<game_id>            one game
+GET /api/v1/games/<game_id>/reviews    a game's reviews, newest first
+GET /api/v1/profile                    the logged in user's reviews and stats
+
+Lists come a page at a time from the same keyset queries as the HTML pages (see
+pagination.py). Each has "next" for the ?after= of the following page, null on the
+last one. ?fields=name,genre picks the columns returned; lists of games leave out
+description unless it is asked for.
+
+Responses carry an ETag and Last-Modified from the change counter of what they show
+(see changes.py), and a request whose If-None-Match or If-Modified-Since is still
+current gets 304 Not Modified without the query being run.
+"""
+
+from flask import Blueprint, g, request, jsonify, abort, Response
+from werkzeug.exceptions import HTTPException
+from database import get_read_db
+from changes import get_counter
+from pagination import page_games, page_game_reviews, page_user_reviews
+from reputation import user_stats
+from datetime import date, datetime, timezone
+import hashlib
+
+
+GAME_FIELDS = ["game_id", "name", "genre", "release_date", "developer", "publisher", "avg_score", "image", "description"]
+GAME_LIST_FIELDS = [field for field in GAME_FIELDS if field != "description"]
+REVIEW_FIELDS = ["review_id", "user_id", "game_id", "date", "description", "score", "helpfulness"]
+
+# ?order= names for the indexes of GAME_ORDERINGS in pagination.py
+GAME_ORDERS = {"release_date": 0, "name": 1, "avg_score": 2}
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+@api.errorhandler(HTTPException)
+def json_error(error):
+    return jsonify({"error": error.description}), error.code
+
+
+# The columns from ?fields=, or default if it is not given
+def requested_fields(allowed, default):
+    fields = request.args.get("fields")
+    if fields is None:
+        return default
+    fields = [field.strip() for field in fields.split(",") if field.strip() != ""]
+    if fields == []:
+        abort(400, "fields must name at least one of: " + ", ".join(allowed))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown != []:
+        abort(400, "Unknown fields: " + ", ".join(unknown) + ". Choose from: " + ", ".join(allowed))
+    return fields
+
+
+def to_json(row, fields):
+    return {field: row[field].isoformat() if isinstance(row[field], date) else row[field] for field in fields}
+
+
+# Runs build() and returns its JSON, unless the client's copy (of this URL, as of
+# change counter name) is still current, then returns 304 without calling build
+def conditional_json(name, build):
+    version, changed_at = get_counter(get_read_db(), name)
+    etag = hashlib.sha1((name + ":" + str(version) + ":" + request.full_path).encode()).hexdigest()[:20]
+    last_modified = None
+    if changed_at is not None:
+        last_modified = datetime.fromtimestamp(int(changed_at), timezone.utc)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = (last_modified is not None and request.if_modified_since is not None
+                        and last_modified <= request.if_modified_since)
+    response = Response(status=304) if not_modified else jsonify(build())
+    response.set_etag(etag)
+    # (Setting last_modified to None would send the current time)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Clients may keep the response, but must check it is still current before using it
+    response.cache_control.no_cache = True
+    return response
+
+
+@api.route("/games")
+def games():
+    fields = requested_fields(GAME_FIELDS, GAME_LIST_FIELDS)
+    order = request.args.get("order", "release_date")
+    if order not in GAME_ORDERS:
+        abort(400, "order must be one of: " + ", ".join(GAME_ORDERS))
+
+    def build():
+        rows, next_page = page_games(get_read_db(), GAME_ORDERS[order], request.args.get("after"),
+                                     request.args.get("genre"), ", ".join(fields))
+        return {"games": [to_json(row, fields) for row in rows], "next": next_page}
+    return conditional_json("games", build)
+
+
+@api.route("/games/<int:game_id>")
+def game(game_id):
+    fields = requested_fields(GAME_FIELDS, GAME_FIELDS)
+
+    def build():
+        row = get_read_db().execute("SELECT " + ", ".join(fields) + " FROM games WHERE game_id = ?;",
+                                    (game_id,)).fetchone()
+        if row is None:
+            abort(404, "No game with id " + str(game_id))
+        return {"game": to_json(row, fields)}
+    return conditional_json("game:" + str(game_id), build)
+
+
+@api.route("/games/<int:game_id>/reviews")
+def game_reviews(game_id):
+    fields = requested_fields(REVIEW_FIELDS, REVIEW_FIELDS)
+
+    def build():
+        rows, next_page = page_game_reviews(get_read_db(), game_id, request.args.get("after"), ", ".join(fields))
+        return {"reviews": [to_json(row, fields) for row in rows], "next": next_page}
+    return conditional_json("game:" + str(game_id), build)
+
+
+@api.route("/profile")
+def profile():
+    # Same users as login_required in app.py, but answered with 401 rather than a redirect
+    if g.user is None or g.user == "admin":
+        abort(401, "Log in to see your profile")
+    fields = requested_fields(REVIEW_FIELDS, REVIEW_FIELDS)
+
+    def build():
+        db = get_read_db()
+        rows, next_page = page_user_reviews(db, g.user, request.args.get("after"), ", ".join(fields))
+        return {"user_id": g.user, "stats": dict(user_stats(db, g.user)),
+                "reviews": [to_json(row, fields) for row in rows], "next": next_page}
+    response = conditional_json("user:" + g.user, build)
+    response.vary.add("Cookie")
+    response.cache_control.private = True
+    return response
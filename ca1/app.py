@@ -21,23 +21,129 @@ I frequently used the following pages (more specific pages are commented where t
 """
 
 
-from flask import Flask, render_template, session, redirect, url_for, g, request
-from flask_session import Session
-from database import get_db, close_db
+import startup
+from flask import Flask, render_template, session, redirect, url_for, g, request, Response, abort
+from database import get_db, get_read_db, close_db, read_pool
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename  # File upload
-from forms import SearchForm, GenreForm, WriteReviewForm, RegistrationForm, LoginForm, AdminLoginForm, AddGameForm, DeleteGameForm, DeleteReviewForm, DeleteUserForm, UploadImageForm, AddNewAdminForm
+from forms import SearchForm, GenreForm, WriteReviewForm, RegistrationForm, LoginForm, AdminLoginForm, AddGameForm, DeleteGameForm, DeleteReviewForm, DeleteUserForm, BulkDeleteForm, UploadImageForm, AddNewAdminForm
+from ratings import create_ratings_tables, rebuild_ratings, verify_ratings
+from search import create_search_index, rebuild_search_index, index_game
+from genres import create_genres_tables, rebuild_genres, set_game_genres, split_genres, genre_facets
+from pagination import GAME_ORDERINGS, create_pagination_indexes, page_games, page_games_by_id, page_reviews
+from reputation import create_reputation_indexes, user_stats, all_user_stats, find_unhelpful_users
+from moderation import get_word_filter, scan_reviews
+from cache import make_cache, cache_key, game_tag, rows_to_dicts
+from votes import create_votes_table, make_vote_buffer, votes_for_game, HELPFUL, NOT_HELPFUL
+from sessions import create_sessions_table, make_session_interface, sweep_expired
+from popularity import configure_popularity, rebuild_popularity, featured_games
+from changes import create_change_counters, get_counter, bump_counter
+from analytics import PERIODS, create_analytics_tables, rebuild_analytics, dashboard
+from recommend import (create_recommendation_tables, rebuild_recommendations, recommended_games, refresh_recommendations,
+                       refresh_stale_recommendations, similar_games)
+from schema import create_foreign_keys, delete_games, delete_users, delete_reviews
+from images import ingest_image, make_variants, ImageTooLarge
+from api import api
+import assets
+import images
+import metrics
+from flask.cli import AppGroup
 from functools import wraps
 from datetime import datetime
+import click
+import sqlite3
 import os  # File upload
 
+startup.mark("imports")
 
 app = Flask(__name__)
 app.teardown_appcontext(close_db)
 app.config["SECRET_KEY"] = "this-is-the-secret-key"
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+# Sessions are kept in app.db, "memory" adds an in-process write-behind cache (see sessions.py)
+app.config["SESSION_BACKEND"] = "sqlite"
+# Users with an average helpfulness of -5 or less, and 4+ reviews, are listed as unhelpful
+app.config["UNHELPFUL_MAX_HELPFULNESS"] = -5
+app.config["UNHELPFUL_MIN_REVIEWS"] = 4
+# Censored words used in writing reviews and registering an account, see moderation.py
+app.config["CENSOR_WHOLE_WORDS"] = False
+app.config["CENSOR_LEET_SPEAK"] = False
+# Use "sqlite" when running several worker processes, so they share invalidations
+app.config["CACHE_BACKEND"] = "memory"
+app.config["CACHE_DEFAULT_TTL"] = 60
+app.config["CACHE_MAX_ENTRIES"] = 1024
+# The home page shows the FEATURED_LIMIT most trending games with FEATURED_MIN_REVIEWS+ reviews
+# A review counts half as much towards trending every TRENDING_HALF_LIFE_DAYS (see popularity.py)
+app.config["FEATURED_MIN_REVIEWS"] = 3
+app.config["FEATURED_LIMIT"] = 30
+app.config["TRENDING_HALF_LIFE_DAYS"] = 14
+# Games shown under "Recommended for you" on the profile and "Players who liked this also liked"
+# on game pages, built by "flask build-recommendations" (see recommend.py)
+app.config["RECOMMENDED_LIMIT"] = 8
+app.config["SIMILAR_LIMIT"] = 6
+# Votes are written in batches of up to VOTE_BUFFER_SIZE, at least every VOTE_FLUSH_INTERVAL seconds
+# Use a VOTE_FLUSH_INTERVAL of 0 in tests, to write each vote before the request returns (see votes.py)
+app.config["VOTE_BUFFER_SIZE"] = 100
+app.config["VOTE_FLUSH_INTERVAL"] = 1
+# Statements slower than this are logged with their query plan (see metrics.py)
+app.config["SLOW_QUERY_MS"] = 100
+app.config["METRICS_HEADERS"] = True
+# Uploaded images are resized into smaller copies by IMAGE_WORKERS threads (see images.py)
+app.config["MAX_IMAGE_BYTES"] = 10 * 1024 * 1024
+app.config["MAX_CONTENT_LENGTH"] = app.config["MAX_IMAGE_BYTES"] + 64 * 1024
+app.config["IMAGE_WORKERS"] = 2
+# Static files are served with hashed URLs and ETags (see assets.py)
+# Set to an internal nginx location, e.g. "/_static/", to have nginx send them instead
+app.config["STATIC_ACCEL_REDIRECT"] = None
+# Compiled templates are kept here for the next worker, None for a folder in the temp directory (see startup.py)
+app.config["TEMPLATE_BYTECODE_DIR"] = None
+# Logs how long each step of start up took when a worker starts (see startup.py)
+app.config["BOOT_REPORT"] = True
+startup.init_app(app)
+app.session_interface = make_session_interface(app.config)
+metrics.init_app(app)
+images.init_app(app)
+assets.init_app(app)
+
+
+# The cache's generation, which CLI commands move on to make every worker's cache miss (see cache.py)
+def cache_generation():
+    db = read_pool.acquire()
+    try:
+        return get_counter(db, "cache")[0]
+    finally:
+        read_pool.release(db)
+
+
+# Call before committing a CLI command's changes, which the write routes' invalidate() calls never saw
+def invalidate_all_caches(db):
+    bump_counter(db, "cache")
+
+
+cache = make_cache(app.config, cache_generation)
+app.register_blueprint(api)
+vote_buffer = make_vote_buffer(app.config,
+                               lambda changed_games: cache.invalidate(*[game_tag(game_id) for game_id in changed_games]))
+
+# Creates the tables which are maintained alongside games/reviews/users/admins
+def create_tables(db):
+    create_ratings_tables(db)
+    configure_popularity(db, app.config["FEATURED_MIN_REVIEWS"], app.config["TRENDING_HALF_LIFE_DAYS"])
+    create_search_index(db)
+    create_genres_tables(db)
+    create_pagination_indexes(db)
+    create_reputation_indexes(db)
+    create_votes_table(db)
+    create_sessions_table(db)
+    create_change_counters(db)
+    create_recommendation_tables(db)
+    create_analytics_tables(db)
+    create_foreign_keys(db)
+
+
+with app.app_context():
+    create_tables(get_db())
+startup.mark("database")
 
 
 @app.before_request
@@ -66,79 +172,102 @@ def admin_required(view):
     return wrapped_view
 
 
-# Used in writing reviews and registering an account
-censored_words = ["fuck", "cunt", "shit", "cum", "bitch", "cock", "nigg", "fag"]
+# Anonymous visitors all see the same page, so it is rendered once and cached (see cache.py)
+# Logged in users see their name in the header, so only the query results are cached for them
+def render_page(key, tags, render):
+    if g.user is not None:
+        return render()
+    return cache.get_or_set("page:" + key, tags, render)
+
 
 @app.route("/")
 def index():
-    db = get_db()
-    # Displays games that have more than 2 reviews
-    games = db.execute("""SELECT * FROM games
-                        WHERE game_id IN (
-                            SELECT game_id
-                            FROM reviews
-                            GROUP BY game_id
-                            HAVING COUNT(*) > 2
-                        )
-                        ORDER BY release_date DESC""").fetchall()
-    return render_template("index.html", title="Home", games=games)
+    def trending_games():
+        # Displays the most trending games with enough reviews, kept up to date by triggers (see popularity.py)
+        return rows_to_dicts(featured_games(get_read_db(), app.config["FEATURED_LIMIT"]))
+
+    def render():
+        games = cache.get_or_set(cache_key("index"), ["games"], trending_games)
+        return render_template("index.html", title="Home", games=games)
+    return render_page(cache_key("index"), ["games"], render)
+
+
+# A page of games for discover, cached until a game or review changes
+def cached_page_games(order, after=None, genre=None, search=None):
+    def query():
+        games, next_page = page_games(get_read_db(), order, after, genre, search=search)
+        return rows_to_dicts(games), next_page
+    return cache.get_or_set(cache_key("discover", order, genre, search, after), ["games"], query)
 
 
 @app.route("/discover/<int:order>", methods=["GET", "POST"])
 def discover(order):
-    # Passed in from jinja to determine how to order games displayed
-    ordering = ["release_date DESC", "name ASC", "avg_score DESC"]
-    order_by = ordering[order]
-    search_form = SearchForm()
-    genre_form = GenreForm()
-    db = get_db()
-    # Take all genres from the database to display & select
-    genres = db.execute(
-        """SELECT DISTINCT genre FROM games ORDER BY genre;""").fetchall()
-    for dict in genres:
-        genre_form.genreFilter.choices.append(dict["genre"])
-    games = db.execute("""SELECT * FROM games ORDER BY """ + order_by + """;""").fetchall()
+    if order >= len(GAME_ORDERINGS):
+        abort(404)
+    # The search, genre and page token are in the URL, so the sort and "Next page" links keep them
+    search = request.args.get("search", "").strip()
+    genre = request.args.get("genre") or None
+    after = request.args.get("after")
+    search_form = SearchForm(search=search)
+    genre_form = GenreForm(genreFilter=genre or "None")
+    # Every genre with its number of games, kept up to date by triggers (see genres.py)
+    # The choices are set on this form only, the class's own list is shared by every request
+    genres = cache.get_or_set(cache_key("genres"), ["games"],
+                              lambda: rows_to_dicts(genre_facets(get_read_db())))
+    genre_form.genreFilter.choices = [("None", "None")] + [
+        (row["name"], row["name"] + " (" + str(row["num_games"]) + ")") for row in genres]
     # https://stackoverflow.com/questions/18290142/multiple-forms-in-a-single-page-using-flask-and-wtforms
+    # Both forms redirect to the page with their value in the URL, keeping the other's
     if search_form.validate_on_submit() and search_form.submitSearch.data:
-        search = search_form.search.data
-        # If user searches nothing, ignores their search
-        if search == "":
-            games = db.execute("""SELECT * FROM games ORDER BY """ + order_by + """;""").fetchall()
-        # Displays their search
-        else:
-            # https://code-boxx.com/search-results-python-flask/
-            games = db.execute(
-                """SELECT * FROM games WHERE name LIKE ?;""", (search+"%",)).fetchall()
+        return redirect(url_for("discover", order=order, search=search_form.search.data.strip() or None, genre=genre))
     #Form for user filtering by game genre
     elif genre_form.validate_on_submit() and genre_form.submitGenre.data:
+        # If user selects None, removes the filter
         genreFilter = genre_form.genreFilter.data
-        # If user selects None, ignores filter
-        if genreFilter == "None":
-            games = db.execute("""SELECT * FROM games ORDER BY """ + order_by + """;""").fetchall()
-        else:
-            games = db.execute(
-                """SELECT * FROM games WHERE genre=? ORDER BY """ + order_by + """;""", (genreFilter,)).fetchall()
+        return redirect(url_for("discover", order=order, search=search or None,
+                                genre=None if genreFilter == "None" else genreFilter))
+    # Displays their search, matching anywhere in the name, developer, publisher, genre or description,
+    # one page at a time like the rest of the games (if user searches nothing, ignores their search)
+    # https://code-boxx.com/search-results-python-flask/
+    games, next_page = cached_page_games(order, after, genre, search or None)
     return render_template("discover.html", title="Discover", 
-                            search_form=search_form, genre_form=genre_form, games=games, order=order)
+                            search_form=search_form, genre_form=genre_form, games=games, order=order,
+                            search=search or None, genre=genre, next_page=next_page)
 
 
 # Takes in game_id from jinja in index.html
 @app.route("/game/<int:game_id>", methods=["GET", "POST"])
 def game(game_id):
-    db = get_db()
-    # Fetches data on the game which the user searched to display on the
-    game = db.execute(
-        """SELECT * FROM games WHERE game_id=?;""", (game_id,)).fetchone()
-    # Fetches review data for the 8 most recent games for this game
-    # Does not display reviews with a low helpfulness score
-    reviews = db.execute("""
-        SELECT *
-        FROM reviews
-        WHERE game_id = ?
-        AND helpfulness > -5
-        ORDER BY date DESC
-        LIMIT 8;""", (game_id,)).fetchall()
-    return render_template("game.html", title=game["name"], game=game, reviews=reviews)
+    tags = [game_tag(game_id)]
+
+    def game_and_reviews():
+        db = get_read_db()
+        # Fetches data on the game which the user searched to display on the
+        game = db.execute(
+            """SELECT * FROM games WHERE game_id=?;""", (game_id,)).fetchone()
+        # Fetches review data for the 8 most recent games for this game
+        # Does not display reviews with a low helpfulness score
+        reviews = db.execute("""
+            SELECT *
+            FROM reviews
+            WHERE game_id = ?
+            AND helpfulness > -5
+            ORDER BY date DESC
+            LIMIT 8;""", (game_id,)).fetchall()
+        # Games liked by the same players, from the last "flask build-recommendations"
+        similar = similar_games(db, game_id, app.config["SIMILAR_LIMIT"])
+        return dict(game), rows_to_dicts(reviews), rows_to_dicts(similar)
+
+    def render():
+        game, reviews, similar = cache.get_or_set(cache_key("game", game_id), tags, game_and_reviews)
+        # The logged in user's own votes, to show which reviews they have rated
+        votes = {}
+        if g.user is not None:
+            votes = votes_for_game(get_read_db(), g.user, game_id)
+            votes.update(vote_buffer.pending_votes(g.user))
+        return render_template("game.html", title=game["name"], game=game, reviews=reviews, votes=votes,
+                               similar=similar)
+    return render_page(cache_key("game", game_id), tags, render)
 
 # Takes in game_id, review_id and helpfulness when user clicks the helpful/not helpful link in game.html
 
@@ -146,27 +275,14 @@ def game(game_id):
 @app.route("/game/<int:game_id>/<int:review_id>/helpfulness/<int:helpfulness>")
 @login_required  # Admins not allowed access
 def helpfulness(game_id, review_id, helpfulness):
-    # Keeps track of helpfulness ratings in the session
-    if "ratings" not in session:
-        session["ratings"] = {}
-    # Updates if the user has not given a rating, or changed their rating
-    if review_id not in session["ratings"] or helpfulness != session["ratings"][review_id]:
-        # Stores their score in session
-        session["ratings"][review_id] = helpfulness
-        # Converts helpfulness to a working score if 0 (not helpful)
-        if helpfulness == 0:
-            helpfulness = -1
-        db = get_db()
-        # Updates helpfulness score if user is not voting for their own review
-        reviewer = db.execute(
-            """SELECT user_id FROM reviews WHERE review_id=?;""", (review_id,)).fetchone()
-        # Checks if user is voting for themself
-        if reviewer["user_id"] != g.user:
-            # Updates review's helpfulness
-            db.execute("""UPDATE reviews
-                        SET helpfulness = helpfulness+?
-                        WHERE review_id=?;""", (helpfulness, review_id))
-            db.commit()
+    # Converts helpfulness to a working score, 0 is not helpful
+    if helpfulness == 0:
+        vote = NOT_HELPFUL
+    else:
+        vote = HELPFUL
+    # Records the vote, or changes the user's earlier vote, with others in one batch (see votes.py)
+    # Users voting for their own review are ignored
+    vote_buffer.add(g.user, review_id, vote)
     # Redirects back, does not have its own page
     return redirect(url_for("game", game_id=game_id))
 
@@ -182,12 +298,8 @@ def write_review(game_id):
         db = get_db()
         user_reviewed = db.execute("""SELECT * FROM reviews
                                 WHERE game_id = ? AND user_id = ?;""", (game_id, g.user)).fetchone()
-        # Checks if review contains censored words
-        censor = False
-        alter_review = review_text.lower()
-        for word in censored_words:
-            if word in alter_review:
-                censor = True
+        # Checks if review contains censored words (see moderation.py)
+        censor = get_word_filter().contains(review_text)
         # Checks if user has already reviewed this game
         if user_reviewed is not None:
             form.review_text.errors.append(
@@ -199,16 +311,13 @@ def write_review(game_id):
             # Makes a date format suitable for SQLites
             current_date = "20" + (datetime.now().strftime("%y-%m-%d"))
             # Inserts reviews into database
+            # The game's average user score is updated by a trigger (see ratings.py)
             db.execute("""INSERT INTO reviews (user_id, game_id, date, description, score, helpfulness)
             VALUES (?, ?, ?, ?, ?, 0);""", (g.user, game_id, current_date, review_text, user_score))
+            # The writer's recommendations are worked out again with the review (see recommend.py)
+            refresh_recommendations(db, g.user, app.config["RECOMMENDED_LIMIT"])
             db.commit()
-            # Updates the average user score for the game
-            db.execute("""UPDATE games SET avg_score =
-                ROUND(((SELECT AVG(score)
-                FROM reviews
-                WHERE game_id = ?) * 10), 0)
-            WHERE game_id = ?;""", (game_id, game_id))
-            db.commit()
+            cache.invalidate("games", game_tag(game_id))
             return redirect(url_for("game", game_id=game_id))
     return render_template("review_form.html", title="Leave a Review!", form=form)
 
@@ -216,15 +325,17 @@ def write_review(game_id):
 @app.route("/profile", methods=["GET", "POST"])
 @login_required  # Admins cannot have profiles
 def profile():
-    db = get_db()
+    db = get_read_db()
     user_reviews = db.execute("""SELECT * FROM reviews AS r
                                 JOIN games AS g
                                 ON r.game_id = g.game_id
                                 WHERE user_id=?;""", (g.user,)).fetchall()
     # Calculates the average score the user has given in their reviews
-    avg_score = db.execute(
-        """SELECT AVG(score) FROM reviews WHERE user_id=?;""", (g.user,)).fetchone()
-    return render_template("profile.html", title=g.user, user_reviews=user_reviews, avg_score=avg_score)
+    stats = user_stats(db, g.user)
+    # Saved per user, worked out again when they write a review or by "flask build-recommendations"
+    recommended = recommended_games(db, g.user, app.config["RECOMMENDED_LIMIT"])
+    return render_template("profile.html", title=g.user, user_reviews=user_reviews, stats=stats,
+                           recommended=recommended)
 
 # ---------------- ADMIN ROUTES ----------------
 
@@ -246,20 +357,25 @@ def add_game():
     form = AddGameForm()
     if form.validate_on_submit():
         name = form.name.data
-        genre = form.genre.data
+        # "Action, rpg ,RPG" is stored as "Action, rpg"
+        genre = ", ".join(split_genres(form.genre.data))
         release_date = form.release_date.data
         developer = form.developer.data
         publisher = form.publisher.data
         image = form.image.data
         description = form.description.data
         db = get_db()
-        # Adds new game to database, with "None" for avg_score, as there will be no reviews
-        db.execute("""INSERT INTO games
+        # Adds new game to database, with NULL for avg_score, as there will be no reviews
+        cursor = db.execute("""INSERT INTO games
                 (name, genre, release_date, developer,
                  publisher, avg_score, image, description)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?);""",
-                (name, genre, release_date, developer, publisher, "None", image, description))
+                VALUES(?, ?, ?, ?, ?, NULL, ?, ?);""",
+                (name, genre, release_date, developer, publisher, image, description))
+        # Makes the game searchable on the discover page, and adds it to its genres' filters
+        index_game(db, cursor.lastrowid)
+        set_game_genres(db, cursor.lastrowid, genre)
         db.commit()
+        cache.invalidate("games")
         # Redirects to the upload_image route so the game can have an accompanying image
         return redirect(url_for("upload_image"))
     return render_template("add_game_form.html", title="Add a game", form=form)
@@ -270,14 +386,14 @@ def add_game():
 def delete_game():
     form = DeleteGameForm()
     db = get_db()
-    games = db.execute("""SELECT * FROM games;""").fetchall()
+    games, next_page = page_games_by_id(db, request.args.get("after"))
     if form.validate_on_submit():
         game_id = form.game_id.data
-        # Deletes the game and all accompanying reviews from the database
-        db.execute("""DELETE FROM games WHERE game_id = ?;""", (game_id,))
-        db.execute("""DELETE FROM reviews WHERE game_id = ?;""", (game_id,))
+        # Deletes the game, its reviews are deleted along with it (see schema.py)
+        delete_games(db, [game_id])
         db.commit()
-    return render_template("delete_game_form.html", title="Delete a game", form=form, games=games)
+        cache.invalidate("games", game_tag(game_id))
+    return render_template("delete_game_form.html", title="Delete a game", form=form, games=games, next_page=next_page)
 
 
 @app.route("/admin/delete-user", methods=["GET", "POST"])
@@ -285,33 +401,15 @@ def delete_game():
 def delete_user():
     form = DeleteUserForm()
     db = get_db()
-    active_users = db.execute("""SELECT DISTINCT user_id FROM reviews""")
-    unhelpful_users = []
-    # For each user who has reviewed
-    for user in active_users:
-        avg_helpfulness = db.execute("""SELECT AVG(helpfulness) FROM reviews
-                                        WHERE user_id=?;""", (user["user_id"],)).fetchone()
-        num_reviews = db.execute("""SELECT COUNT(*) FROM reviews
-                                    WHERE user_id=?;""", (user["user_id"],)).fetchone()
-        # If they have an average helpfulness of 5 or less, and have left 3+ reviews
-        if avg_helpfulness[0] <= -5 and num_reviews[0] > 3:
-            unhelpful_users.append(user["user_id"])
+    # Users with a low average helpfulness, found in one query (see reputation.py)
+    unhelpful_users = find_unhelpful_users(db)
     if form.validate_on_submit():
         user_id = form.user_id.data
-        games_reviewed = db.execute(
-            """SELECT game_id FROM reviews WHERE user_id=?;""", (user_id,)).fetchall()
-        # Deletes the user, and their reviews
-        db.execute("""DELETE FROM users WHERE user_id=?;""", (user_id,))
-        db.execute("""DELETE FROM reviews WHERE user_id=?;""", (user_id,))
-        db.commit()
-        # Updates the score for each game the user has reviewed
-        for game in games_reviewed:
-            db.execute("""UPDATE games SET avg_score =
-                    ROUND(((SELECT AVG(score)
-                    FROM reviews
-                    WHERE game_id = ?) * 10), 0)
-                WHERE game_id = ?;""", (game["game_id"], game["game_id"]))
+        # Deletes the user, and their reviews and votes along with them (see schema.py)
+        # The score of each game they reviewed is updated by a trigger (see ratings.py)
+        games_reviewed = delete_users(db, [user_id])
         db.commit()
+        cache.invalidate("games", *[game_tag(game_id) for game_id in games_reviewed])
     return render_template("delete_user_form.html", title="Delete a User", form=form, unhelpful_users=unhelpful_users)
 
 # Does not immediately display the review being deleted, but when checked again, it has
@@ -322,26 +420,37 @@ def delete_user():
 def delete_review():
     form = DeleteReviewForm()
     db = get_db()
-    reviews = db.execute("""SELECT * FROM reviews AS r
-                        JOIN games AS g
-                        ON g.game_id = r.game_id
-                        ORDER BY g.game_id;""").fetchall()
+    reviews, next_page = page_reviews(db, request.args.get("after"))
     if form.validate_on_submit():
         review_id = form.review_id.data
-        review = db.execute(
-            """SELECT * FROM reviews WHERE review_id = ?;""", (review_id,)).fetchone()
-        game_id = review["game_id"]
-        # Deletes a review
-        db.execute("""DELETE FROM reviews WHERE review_id = ?;""", (review_id,))
+        # Deletes a review, avg_score is updated by a trigger (see ratings.py)
+        games_reviewed = delete_reviews(db, [review_id])
         db.commit()
-        # Updates avg_score after the review is deleted
-        db.execute("""UPDATE games SET avg_score =
-                ROUND(((SELECT AVG(score)
-                FROM reviews
-                WHERE game_id = ?) * 10), 0)
-            WHERE game_id = ?;""", (game_id, game_id))
+        cache.invalidate("games", *[game_tag(game_id) for game_id in games_reviewed])
+    return render_template("delete_review_form.html", title="Delete a Review", form=form, reviews=reviews, next_page=next_page)
+
+
+# Deletes many games, users or reviews at once, e.g. every account of a spammer
+@app.route("/admin/bulk-delete", methods=["GET", "POST"])
+@admin_required
+def bulk_delete():
+    form = BulkDeleteForm()
+    deleted = None
+    if form.validate_on_submit():
+        ids = form.ids.data.replace(",", " ").split()
+        if form.table.data != "users":
+            if not all(id.isdigit() for id in ids):
+                form.ids.errors.append("Game and review IDs must be numbers")
+                return render_template("bulk_delete_form.html", title="Bulk Delete", form=form, deleted=deleted)
+            ids = [int(id) for id in ids]
+        delete = {"games": delete_games, "users": delete_users, "reviews": delete_reviews}[form.table.data]
+        db = get_db()
+        games_changed = delete(db, ids)
+        # Rows deleted by the last statement, not counting those deleted along with them
+        deleted = db.execute("""SELECT changes();""").fetchone()[0]
         db.commit()
-    return render_template("delete_review_form.html", title="Delete a Review", form=form, reviews=reviews)
+        cache.invalidate("games", *[game_tag(game_id) for game_id in games_changed])
+    return render_template("bulk_delete_form.html", title="Bulk Delete", form=form, deleted=deleted)
 
 # https://flask.palletsprojects.com/en/2.2.x/patterns/fileuploads/
 
@@ -370,8 +479,13 @@ def upload_image():
             return redirect(request.url)
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            # Saves file to static folder using the os module
-            file.save(os.path.join(r'static', filename))
+            # Saves file to static folder in chunks, the smaller copies are made in the background
+            try:
+                ingest_image(file, app.static_folder, filename,
+                             app.config["MAX_IMAGE_BYTES"], app.config["IMAGE_WORKERS"])
+            except ImageTooLarge:
+                form.image.errors.append("Images must be smaller than %d MB" % (app.config["MAX_IMAGE_BYTES"] // (1024 * 1024)))
+                return render_template("upload_image_form.html", title="Upload an Image", form=form)
             # Redirects back to admin profile
             return redirect(url_for('admin_profile'))
     return render_template("upload_image_form.html", title="Upload an Image", form=form)
@@ -407,26 +521,45 @@ def new_admin():
 @admin_required
 def see_reviews():
     db = get_db()
-    # Displays all reviews and their game, ordered by game
-    reviews = db.execute("""SELECT * FROM reviews AS r
-                        JOIN games AS g
-                        ON g.game_id = r.game_id
-                        ORDER BY g.game_id;""").fetchall()
-    return render_template("see_reviews.html", title="All Reviews", reviews=reviews)
+    # Displays all reviews and their game, ordered by game, one page at a time
+    reviews, next_page = page_reviews(db, request.args.get("after"))
+    return render_template("see_reviews.html", title="All Reviews", reviews=reviews, next_page=next_page)
 
 
 @app.route("/admin/see-users")
 @admin_required
 def see_users():
     db = get_db()
-    # Displays all users
-    users = db.execute("""SELECT * FROM users;""").fetchall()
-    inactive_users = db.execute("""SELECT * FROM users
-                                WHERE user_id NOT IN
-                                (SELECT user_id FROM reviews);""").fetchall()
+    # Displays all users and their review stats
+    users = all_user_stats(db)
+    inactive_users = [user for user in users if user["num_reviews"] == 0]
     return render_template("see_users.html", title="All Users", users=users, inactive_users=inactive_users)
 
 
+# Review volume, scores and votes by day or week, from the rollups in analytics.py
+# Read on a read connection, so writers are never held up
+@app.route("/admin/analytics")
+@admin_required
+def admin_analytics():
+    period = request.args.get("period", "day")
+    if period not in PERIODS:
+        period = "day"
+    stats = dashboard(get_read_db(), period)
+    # Bars are drawn as a percentage of the largest one
+    max_reviews = max([bucket["num_reviews"] for bucket in stats["volume"]] + [1])
+    max_votes = max([bucket["helpful_votes"] + bucket["unhelpful_votes"] for bucket in stats["volume"]] + [1])
+    max_score_count = max([score["num_reviews"] for score in stats["scores"]] + [1])
+    return render_template("analytics.html", title="Analytics", period=period, stats=stats,
+                           max_reviews=max_reviews, max_votes=max_votes, max_score_count=max_score_count)
+
+
+# Per-endpoint SQL and render counters for this worker, in the Prometheus text format
+@app.route("/admin/metrics")
+@admin_required
+def admin_metrics():
+    return Response(metrics.prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+
 # ---------------- LOGIN AND REGISTRATION ----------------
 
 
@@ -441,11 +574,7 @@ def register():
 			SELECT * FROM users
 			WHERE user_id = ?;
 			""", (user_id,)).fetchone()
-        censor = False
-        alter_id = user_id.lower()
-        for word in censored_words:
-            if word in alter_id:
-                censor = True
+        censor = get_word_filter().contains(user_id)
         if clashing_user is not None:
             form.user_id.errors.append("Username already taken")
         # User cannot name themselves after an admin
@@ -460,6 +589,7 @@ def register():
             VALUES (?, ?);
             """, (user_id, generate_password_hash(password)))
             db.commit()
+            session.regenerate()
             return redirect(url_for("login"))
     return render_template("register.html", title="Register", form=form)
 
@@ -480,6 +610,7 @@ def login():
             form.password.errors.append("User ID or password details are incorrect!")
         else:
             session.clear()
+            session.regenerate()
             session["user_id"]=user_id
             next_page=request.args.get("next")
             if not next_page:
@@ -502,6 +633,7 @@ def admin_login():
             form.admin_id.errors.append("Password details are incorrect!")
         else:
             session.clear()
+            session.regenerate()
             session["user_id"]="admin"
             return redirect(url_for("admin_profile"))
     return render_template("admin_login.html", title="Admin Login", form=form)
@@ -510,3 +642,198 @@ def admin_login():
 def logout():
 	session.clear()
 	return redirect(url_for("index"))
+
+
+
+# ---------------- COMMANDS ----------------
+
+# Run with "flask rebuild-ratings" after bulk imports into the reviews table
+@app.cli.command("rebuild-ratings")
+def rebuild_ratings_command():
+    db = get_db()
+    rebuild_ratings(db)
+    invalidate_all_caches(db)
+    db.commit()
+    click.echo("Rebuilt rating aggregates")
+
+
+@app.cli.command("rebuild-popularity")
+def rebuild_popularity_command():
+    db = get_db()
+    rebuild_popularity(db)
+    invalidate_all_caches(db)
+    db.commit()
+    click.echo("Rebuilt game popularity")
+
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    db = get_db()
+    rebuild_search_index(db)
+    invalidate_all_caches(db)
+    db.commit()
+    click.echo("Rebuilt game search index")
+
+
+# Works out the analytics rollups again from the reviews and votes (see analytics.py)
+@app.cli.command("rebuild-analytics")
+def rebuild_analytics_command():
+    db = get_db()
+    rebuild_analytics(db)
+    invalidate_all_caches(db)
+    db.commit()
+    click.echo("Rebuilt review analytics")
+
+
+# Links every game to the genres in its genre text again, and recounts them
+@app.cli.command("rebuild-genres")
+def rebuild_genres_command():
+    db = get_db()
+    rebuild_genres(db)
+    invalidate_all_caches(db)
+    db.commit()
+    click.echo("Rebuilt genres")
+
+
+# Lists existing reviews which contain words from the current censored word list
+@app.cli.command("scan-reviews")
+def scan_reviews_command():
+    db = get_db()
+    num_found = 0
+    for review_id, user_id, words in scan_reviews(db, get_word_filter()):
+        click.echo(str(review_id) + " (" + user_id + "): " + ", ".join(words))
+        num_found += 1
+    click.echo(str(num_found) + " reviews contain censored words")
+
+
+@app.cli.command("sweep-sessions")
+def sweep_sessions_command():
+    db = get_db()
+    deleted = sweep_expired(db)
+    db.commit()
+    click.echo("Deleted " + str(deleted) + " expired sessions")
+
+
+@app.cli.command("verify-ratings")
+@click.option("--fix", is_flag=True, help="Rebuild the aggregates if any are wrong")
+def verify_ratings_command(fix):
+    db = get_db()
+    mismatched = verify_ratings(db)
+    if mismatched == []:
+        click.echo("Rating aggregates match the reviews table")
+        return
+    click.echo("Mismatched game ids: " + ", ".join(str(game_id) for game_id in mismatched))
+    if fix:
+        rebuild_ratings(db)
+        invalidate_all_caches(db)
+        db.commit()
+        click.echo("Rebuilt rating aggregates")
+    else:
+        raise SystemExit(1)
+
+
+# Works out which games are liked by the same players again, needs NumPy and SciPy (see recommend.py)
+# Run it regularly, e.g. from cron, with --if-changed to skip it when there are no new reviews
+# Either way, works out the recommendations of users whose reviews changed since
+@app.cli.command("build-recommendations")
+@click.option("--if-changed", is_flag=True, help="Only build if reviews changed since the last build")
+def build_recommendations_command(if_changed):
+    db = get_db()
+    try:
+        built = rebuild_recommendations(db, if_changed)
+    except ImportError as error:
+        raise click.ClickException("Building recommendations needs NumPy and SciPy: " + str(error))
+    if built:
+        # Game pages show the similar games
+        invalidate_all_caches(db)
+        db.commit()
+        click.echo("Built recommendations")
+    else:
+        click.echo("No changes since the last build")
+    refreshed = refresh_stale_recommendations(db, app.config["RECOMMENDED_LIMIT"])
+    click.echo("Worked out the recommendations of " + str(refreshed) + " users")
+
+
+# Makes the thumbnail and medium copies of every game image which does not have them yet
+@app.cli.command("build-image-variants")
+def build_image_variants_command():
+    db = get_db()
+    manifest = images.get_manifest(app.static_folder)
+    num_built = 0
+    for game in db.execute("""SELECT DISTINCT image FROM games;""").fetchall():
+        image = game["image"]
+        if image in manifest or not os.path.isfile(os.path.join(app.static_folder, image)):
+            continue
+        if make_variants(app.static_folder, image) != {}:
+            num_built += 1
+    click.echo("Built variants for " + str(num_built) + " images")
+
+
+# Writes .gz/.br copies of static text files, which are sent to browsers that accept them
+@app.cli.command("compress-static")
+def compress_static_command():
+    num_compressed = assets.compress_static(app.static_folder)
+    click.echo("Compressed " + str(num_compressed) + " static files")
+
+
+# "flask data import reviews reviews.csv" and "flask data export games games.jsonl.gz", see bulk.py
+# Made when one of them is run, so workers do not import bulk.py (see startup.py)
+def make_data_commands():
+    from bulk import TABLE_COLUMNS, FORMATS, ON_CONFLICT, DataFileError, guess_format, open_data_file, read_rows, import_rows, export_rows, write_rows
+
+    data_command = AppGroup("data")
+
+    def data_format_for(path, data_format):
+        data_format = data_format or guess_format(path)
+        if data_format is None:
+            raise click.UsageError("Cannot tell the format of " + path + ", use --format")
+        return data_format
+
+    @data_command.command("import")
+    @click.argument("table", type=click.Choice(list(TABLE_COLUMNS)))
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+    @click.option("--format", "data_format", type=click.Choice(FORMATS), help="Defaults to the file extension")
+    @click.option("--on-conflict", type=click.Choice(ON_CONFLICT), default="abort", show_default=True,
+                  help="What to do with rows whose id is already in the table")
+    def data_import_command(table, path, data_format, on_conflict):
+        data_format = data_format_for(path, data_format)
+        db = get_db()
+        with open_data_file(path, "r") as file:
+            try:
+                num_rows = import_rows(db, table, read_rows(file, data_format), on_conflict)
+            except (DataFileError, sqlite3.Error) as error:
+                raise click.ClickException("Nothing was imported: " + str(error))
+        invalidate_all_caches(db)
+        db.commit()
+        click.echo("Imported " + str(num_rows) + " rows into " + table, err=True)
+
+    @data_command.command("export")
+    @click.argument("table", type=click.Choice(list(TABLE_COLUMNS)))
+    @click.argument("path", default="-")
+    @click.option("--format", "data_format", type=click.Choice(FORMATS), help="Defaults to the file extension")
+    def data_export_command(table, path, data_format):
+        data_format = data_format_for(path, data_format) if path != "-" else data_format or "jsonl"
+        with open_data_file(path, "w") as file:
+            num_rows = write_rows(file, data_format, TABLE_COLUMNS[table], export_rows(get_read_db(), table))
+        click.echo("Exported " + str(num_rows) + " rows from " + table, err=True)
+
+    return data_command
+
+
+app.cli.add_command(startup.LazyGroup("data", make_data_commands, help="Import and export games, reviews and users"))
+
+
+# The queries behind the home and discover pages, run while the worker starts (see startup.py)
+def warm_up_queries(db):
+    featured_games(db, app.config["FEATURED_LIMIT"])
+    for order in range(len(GAME_ORDERINGS)):
+        page_games(db, order)
+    genre_facets(db)
+
+
+startup.mark("routes")
+startup.precompile_templates(app)
+startup.mark("templates")
+startup.warm_up(app, warm_up_queries)
+startup.mark("warm up")
+startup.report(app)
@@ -0,0 +1,54 @@
+"""
+ASGI entry point, run with e.g. "uvicorn asgi:application" from this folder
+
+The ASGI server holds every connection on its event loop, reading request bodies and
+sending responses without a thread each, and only hands a request to a thread once
+it has arrived in full. The app itself is the same WSGI app in app.py, run by
+asgiref's WsgiToAsgi, so every route behaves exactly as under a WSGI server.
+
+WsgiToAsgi runs the app with sync_to_async, which by default puts every request on
+one shared thread. Each request is given a ThreadSensitiveContext of its own, so each
+runs on a thread of its own instead. A chunked request body has no Content-Length,
+so the environ says the body ends where its input does, or Werkzeug would read none of it.
+"""
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from app import app
+
+
+class TerminatedInputInstance(WsgiToAsgiInstance):
+
+    def build_environ(self, scope, body):
+        environ = super().build_environ(scope, body)
+        # The whole body has been read into body before the app is called
+        environ["wsgi.input_terminated"] = True
+        return environ
+
+
+class TerminatedInputWsgiToAsgi(WsgiToAsgi):
+
+    async def __call__(self, scope, receive, send):
+        await TerminatedInputInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+wsgi_application = TerminatedInputWsgiToAsgi(app)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    async with ThreadSensitiveContext():
+        await wsgi_application(scope, receive, send)
+
+
+# The app has nothing to start or stop, but servers ask
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,147 @@
+"""
+Serving the static folder (styles.css, cover images and their variants)
+
+url_for("static", filename=...) adds ?v=<content hash> to every static URL, so a file
+changing (e.g. an admin uploading a new image under an old name) changes its URL.
+Requests whose v matches the file's current hash are cached by browsers for a year
+without revalidating. Any other request gets a strong ETag and must revalidate, and
+is answered with 304 when it still matches. Hashes are kept per file until its size
+or mtime changes.
+
+Range requests are handled by send_file. If the browser accepts it, a precompressed
+<file>.br or <file>.gz sibling (made by "flask compress-static") is sent instead of
+the file itself.
+
+With USE_X_SENDFILE the file is sent by the web server (Apache/lighttpd), and with
+STATIC_ACCEL_REDIRECT set to an internal nginx location (e.g. "/_static/") only an
+X-Accel-Redirect header is returned, so workers never copy the bytes themselves.
+"""
+
+from flask import request, send_file, abort, Response
+from werkzeug.security import safe_join
+import gzip
+import hashlib
+import mimetypes
+import os
+
+
+# One year, browsers treat this as forever for immutable responses
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Compressed siblings tried in order, with the Content-Encoding they are sent with
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+# Images are already compressed, so only text files get compressed siblings
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html"}
+
+# {path: (mtime, size, sha256 hex digest)}
+_hashes = {}
+
+
+def content_hash(path):
+    stat = os.stat(path)
+    cached = _hashes.get(path)
+    if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(64 * 1024), b""):
+            digest.update(chunk)
+    _hashes[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def static_path(static_folder, filename):
+    path = safe_join(static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    return path
+
+
+# A compressed sibling which the browser accepts and which is newer than path, or None
+def compressed_sibling(path):
+    for encoding, extension in ENCODINGS:
+        if encoding not in request.accept_encodings:
+            continue
+        try:
+            if os.stat(path + extension).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                return encoding, path + extension
+        except OSError:
+            continue
+    return None
+
+
+def init_app(app):
+
+    @app.url_defaults
+    def add_content_hash(endpoint, values):
+        if endpoint != "static" or "v" in values or "filename" not in values:
+            return
+        path = static_path(app.static_folder, values["filename"])
+        if path is not None:
+            values["v"] = content_hash(path)[:12]
+
+    def static(filename):
+        path = static_path(app.static_folder, filename)
+        if path is None:
+            abort(404)
+        digest = content_hash(path)
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        encoding = None
+        # Byte ranges are of the file itself, so compressed siblings are only for whole files
+        if request.range is None:
+            sibling = compressed_sibling(path)
+            if sibling is not None:
+                encoding, path = sibling
+        etag = digest[:32] + ("-" + encoding if encoding is not None else "")
+
+        accel_prefix = app.config.get("STATIC_ACCEL_REDIRECT")
+        if accel_prefix:
+            response = Response(mimetype=mimetype)
+            response.headers["X-Accel-Redirect"] = accel_prefix.rstrip("/") + "/" + os.path.relpath(path, app.static_folder).replace(os.sep, "/")
+            response.set_etag(etag)
+        else:
+            response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=0)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if filename.endswith(tuple(COMPRESSIBLE_EXTENSIONS)):
+            response.vary.add("Accept-Encoding")
+        if request.args.get("v") == digest[:12]:
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        else:
+            response.cache_control.no_cache = True
+            response.cache_control.max_age = None
+        return response
+
+    app.view_functions["static"] = static
+
+
+# Writes a .gz (and .br, if the brotli module is installed) next to each text file
+# Returns how many files were compressed
+def compress_static(static_folder):
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    num_compressed = 0
+    for folder, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            if os.path.splitext(filename)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = os.path.join(folder, filename)
+            with open(path, "rb") as file:
+                contents = file.read()
+            write_sibling(path + ".gz", gzip.compress(contents, 9, mtime=0))
+            if brotli is not None:
+                write_sibling(path + ".br", brotli.compress(contents))
+            num_compressed += 1
+    return num_compressed
+
+
+def write_sibling(path, contents):
+    with open(path + ".part", "wb") as file:
+        file.write(contents)
+    os.replace(path + ".part", path)
@@ -0,0 +1,357 @@
+"""
+Benchmark and load test for the routes in app.py
+
+Runs entirely offline against its own database file, never app.db:
+
+    python benchmark.py generate --reviews 100000 bench.db
+    python benchmark.py run bench.db --requests 5000 --threads 4 --output run1.json
+    python benchmark.py compare run1.json run2.json
+
+generate fills a new database with synthetic games, users, admins and reviews.
+run replays a weighted mix of discover/search/game/vote/review traffic through the
+Flask test client and reports throughput, p50/p95/p99 latency and SQL statements
+per request for each route, and the peak RSS of the process, as JSON.
+compare prints the change in each number between two runs.
+"""
+
+from datetime import date, timedelta
+import argparse
+import contextvars
+import json
+import os
+import random
+import resource
+import sqlite3
+import sys
+import threading
+import time
+
+
+# The app's own tables, everything else is created by app.py on startup
+BASE_SCHEMA = """
+CREATE TABLE games (
+    game_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    genre TEXT,
+    release_date DATE,
+    developer TEXT,
+    publisher TEXT,
+    avg_score INTEGER,
+    image TEXT,
+    description TEXT
+);
+
+CREATE TABLE reviews (
+    review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    game_id INTEGER,
+    date DATE,
+    description TEXT,
+    score INTEGER,
+    helpfulness INTEGER
+);
+
+CREATE TABLE users (
+    user_id TEXT PRIMARY KEY,
+    password TEXT
+);
+
+CREATE TABLE admins (
+    admin_id TEXT PRIMARY KEY,
+    password TEXT
+);
+"""
+
+GENRES = ["Action", "Adventure", "Fighting", "Platformer", "Puzzle", "Racing",
+          "RPG", "Shooter", "Simulation", "Sports", "Strategy"]
+WORDS = ["dark", "legend", "quest", "star", "iron", "shadow", "kingdom", "space",
+         "racer", "tactics", "dungeon", "odyssey", "zero", "hollow", "crown", "storm"]
+COMPANIES = ["Nintendo", "Sony", "Capcom", "Sega", "Ubisoft", "Valve", "Bungie", "FromSoftware"]
+
+USER_PASSWORD = "benchmark"
+ADMIN_ID = "admin1"
+ADMIN_PASSWORD = "abc123"
+
+BATCH_SIZE = 10000
+
+# Relative weight of each kind of request in a run
+TRAFFIC_MIX = {
+    "index": 10,
+    "discover": 25,
+    "search": 15,
+    "genre": 5,
+    "game": 30,
+    "vote": 10,
+    "review": 3,
+    "profile": 2,
+}
+
+
+def sentence(rng, num_words):
+    return " ".join(rng.choice(WORDS) for i in range(num_words))
+
+
+def generate(path, num_reviews, num_games, num_users, seed=1):
+    # Imported here so "compare" works without Flask installed
+    from werkzeug.security import generate_password_hash
+    if os.path.exists(path):
+        sys.exit(path + " already exists")
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode = WAL;")
+    db.execute("PRAGMA synchronous = OFF;")
+    db.executescript(BASE_SCHEMA)
+    db.execute("""INSERT INTO admins (admin_id, password) VALUES (?, ?);""",
+               (ADMIN_ID, generate_password_hash(ADMIN_PASSWORD)))
+    # Hashing is deliberately slow, so every user shares one hash
+    password = generate_password_hash(USER_PASSWORD)
+    db.executemany("""INSERT INTO users (user_id, password) VALUES (?, ?);""",
+                   (("user" + str(i), password) for i in range(num_users)))
+    first_release = date(1990, 1, 1)
+    db.executemany("""INSERT INTO games
+                (name, genre, release_date, developer, publisher, avg_score, image, description)
+                VALUES (?, ?, ?, ?, ?, NULL, ?, ?);""",
+                   ((sentence(rng, 3).title() + " " + str(i), rng.choice(GENRES),
+                     (first_release + timedelta(days=rng.randrange(12000))).isoformat(),
+                     rng.choice(COMPANIES), rng.choice(COMPANIES), "game" + str(i % 50) + ".png",
+                     sentence(rng, 60)) for i in range(num_games)))
+    db.commit()
+    # Reviews are written in batches, so 10M reviews never sit in memory at once
+    # Popular games get far more reviews than the rest, like real traffic
+    today = date.today()
+    seen = set()
+    batch = []
+    written = 0
+    while written < num_reviews:
+        game_id = min(int(rng.paretovariate(1.2)), num_games)
+        user_id = "user" + str(rng.randrange(num_users))
+        if (game_id, user_id) in seen:
+            game_id = rng.randrange(1, num_games + 1)
+            if (game_id, user_id) in seen:
+                continue
+        # Past a million reviews the set would use too much memory, and repeats are rare anyway
+        if num_reviews <= 1000000:
+            seen.add((game_id, user_id))
+        batch.append((user_id, game_id, (today - timedelta(days=rng.randrange(1100))).isoformat(),
+                      sentence(rng, rng.randrange(5, 40)), rng.randint(1, 10), rng.randint(-8, 12)))
+        written += 1
+        if len(batch) == BATCH_SIZE or written == num_reviews:
+            db.executemany("""INSERT INTO reviews (user_id, game_id, date, description, score, helpfulness)
+                            VALUES (?, ?, ?, ?, ?, ?);""", batch)
+            db.commit()
+            batch = []
+    db.execute("""UPDATE games SET avg_score = (
+                    SELECT ROUND(AVG(score) * 10, 0) FROM reviews
+                    WHERE reviews.game_id = games.game_id);""")
+    db.commit()
+    db.close()
+
+
+# Counts the SQL statements run by each request, including statements inside triggers
+# A context variable rather than a thread local, so work handed to another thread with
+# the request's context (contextvars.copy_context) still counts, and the count is a list
+# so that thread adds to the same one
+statements = contextvars.ContextVar("statements")
+
+
+def count_statement(sql):
+    count = statements.get(None)
+    if count is not None:
+        count[0] += 1
+
+
+def load_app(path, cache_backend):
+    os.environ["CA1_DATABASE"] = os.path.abspath(path)
+    sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+    import database
+    connect = database.connect
+
+    def traced_connect(read_only=False):
+        db = connect(read_only)
+        db.set_trace_callback(count_statement)
+        return db
+    database.connect = traced_connect
+    import app as app_module
+    from cache import make_cache
+    app_module.app.config["WTF_CSRF_ENABLED"] = False
+    app_module.app.config["CACHE_BACKEND"] = cache_backend
+    app_module.cache = make_cache(app_module.app.config, app_module.cache_generation)
+    return app_module.app
+
+
+class Driver:
+
+    def __init__(self, app, db, rng, num_games, num_users, max_review_id, genres, search_terms):
+        self.app = app
+        # The benchmark's own connection, so picking a review to vote on is not counted
+        self.db = db
+        self.rng = rng
+        self.num_games = num_games
+        self.max_review_id = max_review_id
+        self.genres = genres
+        self.search_terms = search_terms
+        self.user_id = "user" + str(rng.randrange(num_users))
+        self.client = app.test_client()
+        self.client.post("/login", data={"user_id": self.user_id, "password": USER_PASSWORD})
+
+    def request(self, kind):
+        rng = self.rng
+        game_id = rng.randint(1, self.num_games)
+        if kind == "index":
+            return self.client.get("/")
+        if kind == "discover":
+            return self.client.get("/discover/" + str(rng.randrange(3)))
+        if kind == "search":
+            return self.client.get("/discover/" + str(rng.randrange(3)),
+                                   query_string={"search": rng.choice(self.search_terms)})
+        if kind == "genre":
+            return self.client.get("/discover/" + str(rng.randrange(3)),
+                                   query_string={"genre": rng.choice(self.genres)})
+        if kind == "game":
+            return self.client.get("/game/" + str(game_id))
+        if kind == "vote":
+            review = self.db.execute("""SELECT review_id, game_id FROM reviews
+                                            WHERE review_id >= ? ORDER BY review_id LIMIT 1;""",
+                                           (rng.randint(1, self.max_review_id),)).fetchone()
+            return self.client.get("/game/" + str(review[1]) + "/" + str(review[0]) +
+                                   "/helpfulness/" + str(rng.randrange(2)))
+        if kind == "review":
+            return self.client.post("/review/" + str(game_id),
+                                    data={"review_text": sentence(rng, 12), "user_score": str(rng.randint(1, 10))})
+        if kind == "profile":
+            return self.client.get("/profile")
+        raise ValueError(kind)
+
+
+def percentile(sorted_values, fraction):
+    if sorted_values == []:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(path, num_requests, num_threads, cache_backend, seed=1):
+    app = load_app(path, cache_backend)
+    info = sqlite3.connect(path)
+    num_games = info.execute("""SELECT MAX(game_id) FROM games;""").fetchone()[0]
+    num_users = info.execute("""SELECT COUNT(*) FROM users;""").fetchone()[0]
+    max_review_id = info.execute("""SELECT MAX(review_id) FROM reviews;""").fetchone()[0]
+    genres = [row[0] for row in info.execute("""SELECT name FROM genres WHERE num_games > 0;""")]
+    info.close()
+    search_terms = WORDS + [word[:2] for word in WORDS] + ["nothing matches this"]
+    kinds = list(TRAFFIC_MIX)
+    weights = [TRAFFIC_MIX[kind] for kind in kinds]
+    results = {kind: {"latencies": [], "statements": [], "errors": 0} for kind in kinds}
+    lock = threading.Lock()
+
+    def worker(worker_id, count):
+        rng = random.Random(seed * 1000 + worker_id)
+        local_db = sqlite3.connect(path)
+        driver = Driver(app, local_db, rng, num_games, num_users, max_review_id, genres, search_terms)
+        for kind in rng.choices(kinds, weights, k=count):
+            count = [0]
+            statements.set(count)
+            start = time.perf_counter()
+            response = driver.request(kind)
+            elapsed = time.perf_counter() - start
+            with lock:
+                result = results[kind]
+                result["latencies"].append(elapsed)
+                result["statements"].append(count[0])
+                if response.status_code >= 500:
+                    result["errors"] += 1
+        local_db.close()
+
+    per_thread = [num_requests // num_threads + (1 if i < num_requests % num_threads else 0)
+                  for i in range(num_threads)]
+    threads = [threading.Thread(target=worker, args=(i, count)) for i, count in enumerate(per_thread)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for kind, result in results.items():
+        latencies = sorted(result["latencies"])
+        if latencies == []:
+            continue
+        routes[kind] = {
+            "requests": len(latencies),
+            "errors": result["errors"],
+            "mean_ms": 1000 * sum(latencies) / len(latencies),
+            "p50_ms": 1000 * percentile(latencies, 0.50),
+            "p95_ms": 1000 * percentile(latencies, 0.95),
+            "p99_ms": 1000 * percentile(latencies, 0.99),
+            "sql_per_request": sum(result["statements"]) / len(result["statements"]),
+        }
+    return {
+        "database": os.path.abspath(path),
+        "requests": num_requests,
+        "threads": num_threads,
+        "cache_backend": cache_backend,
+        "elapsed_s": elapsed,
+        "throughput_rps": num_requests / elapsed,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "routes": routes,
+    }
+
+
+# Prints every number that is in both runs, with the change from the first to the second
+def compare(before, after):
+    def rows(prefix, old, new):
+        for key, value in old.items():
+            if key not in new:
+                continue
+            if isinstance(value, dict):
+                yield from rows(prefix + key + ".", value, new[key])
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                change = "" if value == 0 else "%+.1f%%" % (100 * (new[key] - value) / value)
+                yield prefix + key, value, new[key], change
+    for name, old, new, change in rows("", before, after):
+        print("%-32s %12.2f %12.2f %8s" % (name, old, new, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the routes in app.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate", help="create a database of synthetic data")
+    generate_parser.add_argument("database")
+    generate_parser.add_argument("--reviews", type=int, default=10000)
+    generate_parser.add_argument("--games", type=int, help="default: reviews / 100")
+    generate_parser.add_argument("--users", type=int, help="default: reviews / 20")
+    generate_parser.add_argument("--seed", type=int, default=1)
+    run_parser = commands.add_parser("run", help="replay a traffic mix and report timings")
+    run_parser.add_argument("database")
+    run_parser.add_argument("--requests", type=int, default=2000)
+    run_parser.add_argument("--threads", type=int, default=1)
+    run_parser.add_argument("--cache", default="memory", choices=["memory", "sqlite", "none"])
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        num_games = args.games or max(10, args.reviews // 100)
+        num_users = args.users or max(10, args.reviews // 20)
+        start = time.perf_counter()
+        generate(args.database, args.reviews, num_games, num_users, args.seed)
+        print("Generated %d reviews of %d games by %d users in %.1fs"
+              % (args.reviews, num_games, num_users, time.perf_counter() - start))
+    elif args.command == "run":
+        report = json.dumps(run(args.database, args.requests, args.threads, args.cache, args.seed), indent=2)
+        if args.output:
+            with open(args.output, "w") as file:
+                file.write(report + "\n")
+        else:
+            print(report)
+    else:
+        with open(args.before) as before, open(args.after) as after:
+            compare(json.load(before), json.load(after))
+
+
+if __name__ == "__main__":
+    main()
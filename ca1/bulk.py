@@ -0,0 +1,187 @@
+"""
+Bulk import and export of the games, reviews and users tables
+
+Used by the "flask data import" and "flask data export" commands in app.py. Files are
+CSV (with a header row) or JSON Lines, optionally gzipped (e.g. reviews.jsonl.gz),
+and "-" reads stdin or writes stdout.
+
+Imports stream the file in batches of BATCH_SIZE rows, each inserted with one
+executemany, and the whole file goes in as one transaction, so a bad row leaves the
+database as it was. Reviews must be imported after the games and users they belong
+to, as their foreign keys are checked (see schema.py). The table's indexes and triggers are dropped for the import and
+created again at the end, which is much faster than updating them row by row, and
+the rating aggregates, popularity scores, search index, genre links and analytics are then rebuilt once, in the same transaction.
+
+Exports read the table in primary key order straight off the cursor, so memory use
+stays the same however large the table is.
+"""
+
+from ratings import rebuild_ratings
+from search import rebuild_search_index
+from popularity import rebuild_popularity
+from changes import bump_all_counters
+from genres import rebuild_genres
+from recommend import forget_recommendations
+from analytics import rebuild_analytics
+from itertools import islice
+import csv
+import datetime
+import gzip
+import json
+import sys
+
+
+BATCH_SIZE = 5000
+
+# Columns of each table, in the order they are exported
+# Missing ids are assigned by the database on import
+TABLE_COLUMNS = {
+    "games": ["game_id", "name", "genre", "release_date", "developer", "publisher", "avg_score", "image", "description"],
+    "reviews": ["review_id", "user_id", "game_id", "date", "description", "score", "helpfulness"],
+    "users": ["user_id", "password"],
+}
+
+TABLE_KEYS = {"games": "game_id", "reviews": "review_id", "users": "user_id"}
+
+FORMATS = ["csv", "jsonl"]
+
+# What happens to rows whose id is already in the table
+# "update" is an upsert rather than INSERT OR REPLACE, which would delete the old row
+# and with it (through the foreign keys in schema.py) its reviews
+ON_CONFLICT = ["abort", "ignore", "update"]
+
+
+class DataFileError(Exception):
+    pass
+
+
+# Works out the format from a file name like reviews.csv or games.jsonl.gz
+def guess_format(path):
+    name = path[:-len(".gz")] if path.endswith(".gz") else path
+    for data_format in FORMATS:
+        if name.endswith("." + data_format):
+            return data_format
+    return None
+
+
+def open_data_file(path, mode):
+    if path == "-":
+        return open((sys.stdin if mode == "r" else sys.stdout).fileno(), mode,
+                    encoding="utf-8", newline="", closefd=False)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+# Yields each row of file as a dict
+def read_rows(file, data_format):
+    if data_format == "csv":
+        for row in csv.DictReader(file):
+            # CSV has no nulls, so empty fields are taken as missing
+            yield {column: (value if value != "" else None) for column, value in row.items()}
+    else:
+        for line_number, line in enumerate(file, 1):
+            if line.strip() == "":
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                raise DataFileError("Line " + str(line_number) + " is not valid JSON: " + str(error))
+            # Each line must be one row, like {"name": ..., "genre": ...}
+            if not isinstance(row, dict):
+                raise DataFileError("Line " + str(line_number) + " is not a JSON object")
+            yield row
+
+
+# Drops the indexes and triggers on table and returns the SQL to create them again
+def drop_indexes_and_triggers(db, table):
+    created = db.execute("""SELECT type, name, sql FROM sqlite_master
+                        WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL;""",
+                         (table,)).fetchall()
+    for row in created:
+        db.execute("DROP " + row["type"].upper() + " " + row["name"] + ";")
+    return [row["sql"] for row in created]
+
+
+# Inserts every row of rows into table in one transaction, returns the number of rows read
+def import_rows(db, table, rows, on_conflict="abort", batch_size=BATCH_SIZE):
+    columns = TABLE_COLUMNS[table]
+    unknown = None
+    insert = ("INSERT INTO " + table + " (" + ", ".join(columns) + ")"
+              + " VALUES (" + ", ".join("?" for column in columns) + ")")
+    if on_conflict == "ignore":
+        insert += " ON CONFLICT DO NOTHING"
+    elif on_conflict == "update":
+        insert += (" ON CONFLICT (" + TABLE_KEYS[table] + ") DO UPDATE SET "
+                   + ", ".join(column + " = excluded." + column for column in columns if column != TABLE_KEYS[table]))
+
+    def values():
+        nonlocal unknown
+        for row in rows:
+            if unknown is None:
+                unknown = set(row) - set(columns)
+                if unknown != set():
+                    raise DataFileError("Unknown columns for " + table + ": " + ", ".join(sorted(unknown)))
+            yield tuple(row.get(column) for column in columns)
+
+    num_rows = 0
+    db.execute("BEGIN IMMEDIATE;")
+    try:
+        recreate = drop_indexes_and_triggers(db, table)
+        batches = values()
+        while True:
+            batch = list(islice(batches, batch_size))
+            if batch == []:
+                break
+            db.executemany(insert, batch)
+            num_rows += len(batch)
+        for sql in recreate:
+            db.execute(sql)
+        # The triggers which keep these up to date were dropped, so they are rebuilt in full
+        if table in ("games", "reviews"):
+            rebuild_ratings(db)
+            rebuild_popularity(db)
+        if table == "games":
+            rebuild_search_index(db)
+            rebuild_genres(db)
+        bump_all_counters(db)
+        if table == "reviews":
+            forget_recommendations(db)
+            rebuild_analytics(db)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return num_rows
+
+
+# Yields each row of table as a dict, in primary key order
+def export_rows(db, table):
+    columns = TABLE_COLUMNS[table]
+    cursor = db.execute("SELECT " + ", ".join(columns) + " FROM " + table
+                        + " ORDER BY " + TABLE_KEYS[table] + ";")
+    for row in cursor:
+        yield dict(zip(columns, row))
+
+
+# Writes rows to file, returns how many were written
+def write_rows(file, data_format, columns, rows):
+    num_rows = 0
+    if data_format == "csv":
+        writer = csv.DictWriter(file, columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            num_rows += 1
+    else:
+        for row in rows:
+            file.write(json.dumps(row, default=json_default) + "\n")
+            num_rows += 1
+    return num_rows
+
+
+# Dates come back from the database as date objects (PARSE_DECLTYPES)
+def json_default(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError("Cannot export " + repr(value))
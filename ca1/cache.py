@@ -0,0 +1,238 @@
+"""
+Cache for query results and rendered pages
+
+Entries are stored with the tags of the data they were built from, e.g. "games"
+for any list of games, or "game:3" for the page of game 3. The write routes call
+invalidate() with the tags of what they changed, which bumps each tag's version;
+an entry saved under an older version of any of its tags is treated as missing.
+Every entry also expires after a TTL, and the least recently used entries are
+dropped once the cache is full.
+
+Backends, chosen with app.config["CACHE_BACKEND"]:
+- "memory": an LRU dict in each worker process (the default)
+- "sqlite": a separate SQLite file shared by every worker on the host, so an
+  invalidation in one worker is seen by all of them
+- "none": caching turned off
+
+Commands run from the CLI (e.g. "flask rebuild-ratings") are a separate process,
+so they cannot reach the workers' memory. They move on a generation number kept in
+the app's database instead (see changes.py), which every Cache reads at most once
+every CACHE_GENERATION_INTERVAL seconds, and an entry saved under an older
+generation is treated as missing, like one under an older tag version.
+"""
+
+from collections import OrderedDict
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_TTL = 60
+GENERATION_INTERVAL = 1
+MAX_ENTRIES = 1024
+CACHE_DATABASE = os.path.join(os.path.abspath(os.path.dirname(__file__)), "cache.db")
+
+
+class MemoryBackend:
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Tag versions are never evicted, or an old entry could match a reset version
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_versions(self, tags):
+        return tuple(self.versions.get(tag, 0) for tag in tags)
+
+    def bump_versions(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+
+
+class SQLiteBackend:
+
+    def __init__(self, path=CACHE_DATABASE, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.connect().executescript("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                expires REAL NOT NULL,
+                value BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS cache_entries_by_expiry ON cache_entries (expires);
+            CREATE TABLE IF NOT EXISTS cache_tags (
+                tag TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            ) WITHOUT ROWID;""")
+
+    # One connection per thread, in autocommit mode
+    def connect(self):
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, isolation_level=None)
+            db.execute("PRAGMA journal_mode = WAL;")
+            db.execute("PRAGMA synchronous = OFF;")
+            db.execute("PRAGMA busy_timeout = 1000;")
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def get(self, key):
+        row = self.connect().execute("""SELECT value FROM cache_entries
+                                    WHERE key = ? AND expires >= ?;""", (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        db = self.connect()
+        now = time.time()
+        db.execute("""INSERT OR REPLACE INTO cache_entries (key, expires, value)
+                    VALUES (?, ?, ?);""", (key, now + ttl, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+        # Drops expired entries, then the ones closest to expiring if still full
+        db.execute("""DELETE FROM cache_entries WHERE expires < ?;""", (now,))
+        db.execute("""DELETE FROM cache_entries WHERE key IN (
+                        SELECT key FROM cache_entries
+                        ORDER BY expires DESC
+                        LIMIT -1 OFFSET ?);""", (self.max_entries,))
+
+    def clear(self):
+        self.connect().execute("""DELETE FROM cache_entries;""")
+
+    def get_versions(self, tags):
+        if tags == []:
+            return ()
+        rows = self.connect().execute("""SELECT tag, version FROM cache_tags
+                                    WHERE tag IN (""" + ", ".join("?" * len(tags)) + """);""", tags).fetchall()
+        versions = dict(rows)
+        return tuple(versions.get(tag, 0) for tag in tags)
+
+    def bump_versions(self, tags):
+        self.connect().executemany("""INSERT INTO cache_tags (tag, version) VALUES (?, 1)
+                                    ON CONFLICT (tag) DO UPDATE SET version = version + 1;""",
+                                   [(tag,) for tag in tags])
+
+
+class NullBackend:
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def clear(self):
+        pass
+
+    def get_versions(self, tags):
+        return ()
+
+    def bump_versions(self, tags):
+        pass
+
+
+class Cache:
+
+    # generation() returns the current generation, if it is given
+    def __init__(self, backend, default_ttl=DEFAULT_TTL, generation=None, generation_interval=GENERATION_INTERVAL):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.generation = generation
+        self.generation_interval = generation_interval
+        # (generation, when it was read), replaced as a whole so threads never see half of it
+        self.last_generation = (None, 0.0)
+
+    # Returns the cached value for key, or calls compute() and caches what it returns
+    def get_or_set(self, key, tags, compute, ttl=None):
+        versions, found, value = self.lookup(key, tags)
+        if found:
+            return value
+        value = compute()
+        self.store(key, versions, value, ttl)
+        return value
+
+    # Returns (the current versions of tags, whether key is cached under them, its value)
+    # The current generation is the first of the versions
+    def lookup(self, key, tags):
+        versions = (self.current_generation(),) + self.backend.get_versions(list(tags))
+        entry = self.backend.get(key)
+        if entry is not None and entry[0] == versions:
+            return versions, True, entry[1]
+        return versions, False, None
+
+    def store(self, key, versions, value, ttl=None):
+        self.backend.set(key, (versions, value), ttl or self.default_ttl)
+
+    def current_generation(self):
+        if self.generation is None:
+            return None
+        generation, read_at = self.last_generation
+        now = time.monotonic()
+        if now - read_at >= self.generation_interval:
+            generation = self.generation()
+            self.last_generation = (generation, now)
+        return generation
+
+    def invalidate(self, *tags):
+        self.backend.bump_versions(list(tags))
+
+    def clear(self):
+        self.backend.clear()
+
+
+def make_cache(config, generation=None):
+    backend_name = config.get("CACHE_BACKEND", "memory")
+    max_entries = config.get("CACHE_MAX_ENTRIES", MAX_ENTRIES)
+    if backend_name == "memory":
+        backend = MemoryBackend(max_entries)
+    elif backend_name == "sqlite":
+        backend = SQLiteBackend(config.get("CACHE_DATABASE", CACHE_DATABASE), max_entries)
+    elif backend_name == "none":
+        backend = NullBackend()
+    else:
+        raise ValueError("Unknown CACHE_BACKEND " + repr(backend_name))
+    return Cache(backend, config.get("CACHE_DEFAULT_TTL", DEFAULT_TTL), generation,
+                 config.get("CACHE_GENERATION_INTERVAL", GENERATION_INTERVAL))
+
+
+# sqlite3.Row cannot be pickled or outlive its cursor, so results are cached as dicts
+def rows_to_dicts(rows):
+    return [dict(row) for row in rows]
+
+
+def cache_key(*parts):
+    return ":".join(repr(part) for part in parts)
+
+
+# Tag for everything shown about one game, "games" is the tag for lists of games
+def game_tag(game_id):
+    return "game:" + str(game_id)
@@ -0,0 +1,131 @@
+"""
+Change counters, for ETag and Last-Modified headers
+
+change_counters has a version number and a last changed time for:
+- "games": any game, or any review's score (which moves its game's)
+- "game:<game_id>": that game, or any of its reviews
+- "user:<user_id>": any review written by that user
+kept up to date by triggers on games and reviews, in the same transaction as the
+change, and:
+- "cache": the generation of every worker's cache (see cache.py), moved on by CLI
+  commands with bump_counter
+
+The update triggers only fire for the columns the API shows, and not for
+games.avg_score, which only moves when a review does and so has already bumped the
+counters, so each write bumps each counter once. A vote (reviews.helpfulness) bumps
+the counters of the review's game and user, but not "games", as lists of games do not
+show it.
+api.py reads one counter to decide whether a client's copy is still current, without
+running the query behind it. A name with no row has never changed.
+"""
+
+import json
+
+
+# Moves the counter called {name} on, changed_at is in seconds since 1970 like time.time()
+BUMP = """
+    INSERT INTO change_counters (name, version, changed_at)
+    VALUES ({name}, 1, (julianday('now') - 2440587.5) * 86400.0)
+    ON CONFLICT (name) DO UPDATE SET
+        version = version + 1,
+        changed_at = excluded.changed_at;"""
+
+# As BUMP, but only when {condition} holds, so an update bumps an unchanged key once
+BUMP_IF = """
+    INSERT INTO change_counters (name, version, changed_at)
+    SELECT {name}, 1, (julianday('now') - 2440587.5) * 86400.0 WHERE {condition}
+    ON CONFLICT (name) DO UPDATE SET
+        version = version + 1,
+        changed_at = excluded.changed_at;"""
+
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS change_counters (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    changed_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS changes_after_game_insert
+AFTER INSERT ON games
+BEGIN{games}{new_game}
+END;
+
+CREATE TRIGGER IF NOT EXISTS changes_after_game_update
+AFTER UPDATE OF name, genre, release_date, developer, publisher, image, description ON games
+BEGIN{games}{old_game}{moved_game}
+END;
+
+CREATE TRIGGER IF NOT EXISTS changes_after_game_delete
+AFTER DELETE ON games
+BEGIN{games}{old_game}
+END;
+
+CREATE TRIGGER IF NOT EXISTS changes_after_review_insert
+AFTER INSERT ON reviews
+BEGIN{games}{new_game}{new_user}
+END;
+
+CREATE TRIGGER IF NOT EXISTS changes_after_review_update
+AFTER UPDATE OF user_id, game_id, date, description, score, helpfulness ON reviews
+BEGIN{old_game}{moved_game}{old_user}{moved_user}
+END;
+
+CREATE TRIGGER IF NOT EXISTS changes_after_review_score_update
+AFTER UPDATE OF user_id, game_id, score ON reviews
+BEGIN{games}
+END;
+
+CREATE TRIGGER IF NOT EXISTS changes_after_review_delete
+AFTER DELETE ON reviews
+BEGIN{games}{old_game}{old_user}
+END;
+""".format(games=BUMP.format(name="'games'"),
+           new_game=BUMP.format(name="'game:' || NEW.game_id"),
+           old_game=BUMP.format(name="'game:' || OLD.game_id"),
+           new_user=BUMP.format(name="'user:' || NEW.user_id"),
+           old_user=BUMP.format(name="'user:' || OLD.user_id"),
+           moved_game=BUMP_IF.format(name="'game:' || NEW.game_id", condition="NEW.game_id IS NOT OLD.game_id"),
+           moved_user=BUMP_IF.format(name="'user:' || NEW.user_id", condition="NEW.user_id IS NOT OLD.user_id"))
+
+
+# Triggers which fired on every update, and bumped an unchanged key twice, before
+# they were limited to some columns
+OLD_TRIGGERS = ["changes_after_game_update", "changes_after_review_update"]
+
+
+def create_change_counters(db):
+    old = db.execute("""SELECT name FROM sqlite_master
+                    WHERE type = 'trigger' AND sql NOT LIKE '%UPDATE OF%'
+                    AND name IN (SELECT value FROM json_each(?));""", (json.dumps(OLD_TRIGGERS),)).fetchall()
+    for trigger in old:
+        db.execute("DROP TRIGGER " + trigger["name"] + ";")
+    db.executescript(CHANGES_SCHEMA)
+
+
+# Returns (version, changed_at) of the counter, (0, None) if it has never changed
+def get_counter(db, name):
+    row = db.execute("""SELECT version, changed_at FROM change_counters WHERE name = ?;""", (name,)).fetchone()
+    if row is None:
+        return 0, None
+    return row["version"], row["changed_at"]
+
+
+# Moves the counter called name on, does not commit
+def bump_counter(db, name):
+    db.execute(BUMP.format(name="?"), (name,))
+
+
+# Moves every counter on, after changes made with the triggers missing (see bulk.py)
+# Includes deleted games and users, and ones which have never changed
+# ("WHERE true" is how SQLite tells the ON CONFLICT of an upsert from a join)
+def bump_all_counters(db):
+    db.execute("""INSERT INTO change_counters (name, version, changed_at)
+                SELECT name, 1, (julianday('now') - 2440587.5) * 86400.0
+                FROM (SELECT 'games' AS name
+                      UNION ALL SELECT 'game:' || game_id FROM games
+                      UNION ALL SELECT 'user:' || user_id FROM users
+                      UNION SELECT name FROM change_counters)
+                WHERE true
+                ON CONFLICT (name) DO UPDATE SET
+                    version = version + 1,
+                    changed_at = excluded.changed_at;""")
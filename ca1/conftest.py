@@ -0,0 +1,47 @@
+from benchmark import BASE_SCHEMA
+from werkzeug.security import generate_password_hash
+import os
+import sqlite3
+import tempfile
+import pytest
+
+
+USER_PASSWORD = "password"
+
+
+# Games, users and reviews as the original app made them: no foreign keys, and
+# avg_score is filled in by the app's triggers once app.py is imported
+def make_base_database(path):
+    db = sqlite3.connect(path)
+    db.executescript(BASE_SCHEMA)
+    password = generate_password_hash(USER_PASSWORD)
+    db.executemany("""INSERT INTO users (user_id, password) VALUES (?, ?);""",
+                   [("alice", password), ("bob", password), ("carol", password)])
+    db.executemany("""INSERT INTO games (name, genre, release_date, developer, publisher, image, description)
+                    VALUES (?, ?, ?, 'Dev', 'Pub', 'cover.png', ?);""",
+                   [("Star Quest", "RPG", "2020-01-01", "A quest among the stars"),
+                    ("Iron Racer", "Racing", "2021-06-01", "Racing on iron tracks"),
+                    ("Puzzle Kingdom", "Puzzle, RPG", "2019-03-15", "Puzzles in a kingdom")])
+    db.executemany("""INSERT INTO reviews (user_id, game_id, date, description, score, helpfulness)
+                    VALUES (?, ?, '2024-05-01', 'Review text', ?, 0);""",
+                   [("alice", 1, 8), ("bob", 1, 6), ("alice", 2, 4), ("carol", 3, 9)])
+    db.commit()
+    db.close()
+
+
+# app.py creates its tables when it is imported, so its database is made first
+TEST_DATABASE = os.path.join(tempfile.mkdtemp(prefix="ca1-tests-"), "app.db")
+make_base_database(TEST_DATABASE)
+os.environ["CA1_DATABASE"] = TEST_DATABASE
+
+
+@pytest.fixture
+def app():
+    from app import app
+    app.config["WTF_CSRF_ENABLED"] = False
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -1,18 +1,103 @@
-from flask import g 
+from flask import g
+from metrics import InstrumentedConnection
+from popularity import create_math_functions
 import os
+import queue
 import sqlite3
+import threading
+
+# CA1_DATABASE points the app at another database file, e.g. one made by benchmark.py
+DATABASE = os.environ.get("CA1_DATABASE",
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), "app.db"))
+
+# Run on every new connection
+# WAL lets readers carry on while a write is in progress, and NORMAL sync is safe with WAL
+CONNECTION_PRAGMAS = [
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA cache_size = -16000;",
+    "PRAGMA mmap_size = 268435456;",
+    "PRAGMA temp_store = MEMORY;",
+    # Deleting a game or user also deletes their reviews and votes (see schema.py)
+    "PRAGMA foreign_keys = ON;",
+]
+
+# Number of prepared statements the sqlite3 module keeps for reuse on each connection
+CACHED_STATEMENTS = 256
+
+# Most idle connections kept in each pool, extra ones are closed when returned
+MAX_IDLE_CONNECTIONS = 8
+
+
+def connect(read_only=False):
+    # Connections move between request threads, but are only used by one at a time
+    # Every statement is timed and counted for the request (see metrics.py)
+    db = sqlite3.connect(DATABASE,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        cached_statements=CACHED_STATEMENTS,
+        check_same_thread=False,
+        factory=InstrumentedConnection
+    )
+    db.row_factory = sqlite3.Row
+    create_math_functions(db)
+    for pragma in CONNECTION_PRAGMAS:
+        db.execute(pragma)
+    if read_only:
+        db.execute("PRAGMA query_only = ON;")
+    else:
+        db.execute("PRAGMA journal_mode = WAL;")
+    return db
+
+
+class ConnectionPool:
+
+    def __init__(self, read_only=False, max_idle=MAX_IDLE_CONNECTIONS):
+        self.read_only = read_only
+        self.idle = queue.LifoQueue(max_idle)
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # A forked worker must not share its parent's connections
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.idle = queue.LifoQueue(self.idle.maxsize)
+                    self.pid = os.getpid()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return connect(self.read_only)
+
+    def release(self, db):
+        # Leaves the connection clean for the next request
+        if db.in_transaction:
+            db.rollback()
+        try:
+            self.idle.put_nowait(db)
+        except queue.Full:
+            db.close()
+
+
+write_pool = ConnectionPool()
+read_pool = ConnectionPool(read_only=True)
 
-DATABASE = os.path.join(os.path.abspath(os.path.dirname(__file__)), "app.db")
 
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(DATABASE,
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = write_pool.acquire()
     return g.db
 
+# For routes which only read, so they never wait for a writer's connection
+def get_read_db():
+    if "read_db" not in g:
+        g.read_db = read_pool.acquire()
+    return g.read_db
+
 def close_db(e=None):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
\ No newline at end of file
+        write_pool.release(db)
+    read_db = g.pop("read_db", None)
+    if read_db is not None:
+        read_pool.release(read_db)
@@ -38,7 +38,7 @@ class AdminLoginForm(FlaskForm):
 # Admin Forms
 class AddGameForm(FlaskForm):
     name = StringField("Game Name:", validators=[InputRequired()])
-    genre = StringField("Genre:", validators=[InputRequired()])
+    genre = StringField("Genres (separated by commas):", validators=[InputRequired()])
     release_date = DateField("Date (YYYY-MM-DD):", format='%Y-%m-%d', validators=[InputRequired()])
     developer = StringField("Developer:", validators=[InputRequired()])
     publisher = StringField("Publisher:", validators=[InputRequired()])
@@ -58,6 +58,11 @@ class DeleteUserForm(FlaskForm):
     user_id = StringField("User ID:", validators=[InputRequired()])
     submit = SubmitField("Delete")
 
+class BulkDeleteForm(FlaskForm):
+    table = SelectField("Delete:", choices=[("games", "Games"), ("users", "Users"), ("reviews", "Reviews")])
+    ids = TextAreaField("IDs (separated by spaces, commas or new lines):", validators=[InputRequired()])
+    submit = SubmitField("Delete")
+
 # https://wtforms.readthedocs.io/en/2.3.x/fields/
 class UploadImageForm(FlaskForm):
     image = FileField("Image File:", validators=[FileRequired(), FileAllowed(["jpg", "jpeg", "png"], "Images only!")])
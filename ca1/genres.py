@@ -0,0 +1,102 @@
+"""
+Genres for the discover page filter
+
+A game's genre is free text from the add game form, and can name several genres
+separated by commas ("Action, RPG"). Each genre has one row in genres (matched
+ignoring case) and game_genres links games to their genres, so filtering by a
+genre reads its games from the primary key of game_genres rather than comparing
+the text of every game.
+
+genres.num_games is the number of games in each genre, shown next to it in the
+filter and kept up to date by triggers on game_genres. Deleting a game deletes its
+game_genres rows (see schema.py), which takes it off the counts.
+
+add_game links a new game with set_game_genres, "flask rebuild-genres" in app.py
+rebuilds the links from the genre text of every game.
+"""
+
+
+GENRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS genres (
+    genre_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+    num_games INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS game_genres (
+    genre_id INTEGER NOT NULL REFERENCES genres (genre_id) ON DELETE CASCADE,
+    game_id INTEGER NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+    PRIMARY KEY (genre_id, game_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS game_genres_by_game ON game_genres (game_id);
+
+CREATE TRIGGER IF NOT EXISTS genres_after_game_genre_insert
+AFTER INSERT ON game_genres
+BEGIN
+    UPDATE genres SET num_games = num_games + 1 WHERE genre_id = NEW.genre_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS genres_after_game_genre_delete
+AFTER DELETE ON game_genres
+BEGIN
+    UPDATE genres SET num_games = num_games - 1 WHERE genre_id = OLD.genre_id;
+END;
+"""
+
+
+def create_genres_tables(db):
+    db.executescript(GENRES_SCHEMA)
+    # Links the existing games the first time the tables are created
+    empty = db.execute("""SELECT NOT EXISTS (SELECT 1 FROM game_genres)
+                        AND EXISTS (SELECT 1 FROM games);""").fetchone()[0]
+    if empty:
+        rebuild_genres(db)
+        db.commit()
+
+
+# The genres named in a game's genre text, without blanks or repeats
+def split_genres(text):
+    names = []
+    for name in (text or "").split(","):
+        name = " ".join(name.split())
+        if name != "" and name.lower() not in [other.lower() for other in names]:
+            names.append(name)
+    return names
+
+
+# Links the game to the genres in text, adding any genres which are new
+def set_game_genres(db, game_id, text):
+    db.execute("""DELETE FROM game_genres WHERE game_id = ?;""", (game_id,))
+    link_genres(db, [(game_id, name) for name in split_genres(text)])
+
+
+def link_genres(db, links):
+    db.executemany("""INSERT INTO genres (name) VALUES (?)
+                    ON CONFLICT (name) DO NOTHING;""", [(name,) for game_id, name in links])
+    db.executemany("""INSERT INTO game_genres (genre_id, game_id)
+                    SELECT genre_id, ? FROM genres WHERE name = ?;""", links)
+
+
+def rebuild_genres(db):
+    db.execute("""DELETE FROM game_genres;""")
+    db.execute("""DELETE FROM genres;""")
+    link_genres(db, [(game["game_id"], name)
+                     for game in db.execute("""SELECT game_id, genre FROM games;""").fetchall()
+                     for name in split_genres(game["genre"])])
+
+
+# Every genre with at least one game and its number of games, in name order
+def genre_facets(db):
+    return db.execute("""SELECT name, num_games FROM genres
+                        WHERE num_games > 0
+                        ORDER BY name;""").fetchall()
+
+
+# A condition on games.game_id for the games in genre (matched ignoring case), and its parameters
+def in_genre(genre):
+    return ("""games.game_id IN (SELECT gg.game_id
+                                 FROM genres AS ge
+                                 JOIN game_genres AS gg
+                                 ON gg.genre_id = ge.genre_id
+                                 WHERE ge.name = ?)""", [genre])
@@ -0,0 +1,169 @@
+"""
+Image uploads and the smaller copies of each cover shown in listings
+
+ingest_image streams an upload into the static folder in chunks, refusing it once it
+passes the size limit, and hashes it on the way. The resizing is then handed to a
+pool of worker threads so the admin's request returns straight away. Each variant
+(see VARIANT_WIDTHS) is saved as static/covers/<name>-<hash>-<variant>.webp (or .jpg
+if Pillow has no WebP support), so a new upload under the same name gets a new URL.
+
+covers/manifest.json maps each original file name to its variants, and the
+cover_url template global uses it to pick the variant for a page, falling back to
+the original image until the variants exist. Resizing needs Pillow, without it
+only the originals are served.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, url_for
+import hashlib
+import json
+import os
+import threading
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+IMAGE_WORKERS = 2
+
+# Largest width of each variant, the height keeps the image's shape
+VARIANT_WIDTHS = {"thumb": 240, "medium": 640}
+
+VARIANT_FOLDER = "covers"
+MANIFEST = "manifest.json"
+
+_executor = None
+_executor_lock = threading.Lock()
+_manifest_lock = threading.Lock()
+_manifest_cache = {"path": None, "mtime": None, "variants": {}}
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def get_executor(num_workers=IMAGE_WORKERS):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(num_workers, thread_name_prefix="image")
+        return _executor
+
+
+# Saves file (a werkzeug FileStorage) as static_folder/filename, without ever holding it all in memory
+# Returns the sha256 of the contents, raises ImageTooLarge past max_bytes
+def save_upload(file, static_folder, filename, max_bytes=MAX_IMAGE_BYTES):
+    path = os.path.join(static_folder, filename)
+    partial_path = path + ".part"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(partial_path, "wb") as partial:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLarge(filename)
+                digest.update(chunk)
+                partial.write(chunk)
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return digest.hexdigest()
+
+
+# Must be called in a request, whose app logs the resizing if it fails
+def ingest_image(file, static_folder, filename, max_bytes=MAX_IMAGE_BYTES, num_workers=IMAGE_WORKERS):
+    digest = save_upload(file, static_folder, filename, max_bytes)
+    future = get_executor(num_workers).submit(make_variants, static_folder, filename, digest)
+    # Nothing waits for the result, so an error would otherwise be lost with the future
+    app = current_app._get_current_object()
+
+    def log_failure(future):
+        error = future.exception()
+        if error is not None:
+            app.logger.exception("Could not make the variants of %s", filename, exc_info=error)
+    future.add_done_callback(log_failure)
+    return future
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Resizes static_folder/filename into every variant and records them in the manifest
+# Runs on the worker pool, so it must not touch the request or app context
+def make_variants(static_folder, filename, digest=None):
+    # Pillow is only needed here, so it is not imported until the first upload
+    try:
+        from PIL import Image, features
+    except ImportError:
+        return {}
+    if digest is None:
+        digest = file_digest(os.path.join(static_folder, filename))
+    extension = "webp" if features.check("webp") else "jpg"
+    variant_folder = os.path.join(static_folder, VARIANT_FOLDER)
+    os.makedirs(variant_folder, exist_ok=True)
+    stem = os.path.splitext(filename)[0]
+    variants = {}
+    with Image.open(os.path.join(static_folder, filename)) as original:
+        original.load()
+        for variant, width in VARIANT_WIDTHS.items():
+            variant_name = stem + "-" + digest[:12] + "-" + variant + "." + extension
+            variant_path = os.path.join(variant_folder, variant_name)
+            if not os.path.exists(variant_path):
+                image = original.copy()
+                image.thumbnail((width, width * 4))
+                if extension == "jpg" or image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGB")
+                image.save(variant_path + ".part", format=extension.replace("jpg", "jpeg"), quality=80)
+                os.replace(variant_path + ".part", variant_path)
+            variants[variant] = VARIANT_FOLDER + "/" + variant_name
+    update_manifest(static_folder, filename, variants)
+    return variants
+
+
+def update_manifest(static_folder, filename, variants):
+    path = os.path.join(static_folder, VARIANT_FOLDER, MANIFEST)
+    with _manifest_lock:
+        manifest = read_manifest(path)
+        manifest[filename] = variants
+        with open(path + ".part", "w") as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+        os.replace(path + ".part", path)
+
+
+def read_manifest(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+# The manifest, re-read only when the file changes
+def get_manifest(static_folder):
+    path = os.path.join(static_folder, VARIANT_FOLDER, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    if _manifest_cache["path"] != path or _manifest_cache["mtime"] != mtime:
+        _manifest_cache["variants"] = read_manifest(path)
+        _manifest_cache["path"] = path
+        _manifest_cache["mtime"] = mtime
+    return _manifest_cache["variants"]
+
+
+def init_app(app):
+    # Template global, e.g. {{ cover_url(game['image'], 'thumb') }}
+    def cover_url(image, variant):
+        path = get_manifest(app.static_folder).get(image, {}).get(variant, image)
+        return url_for("static", filename=path)
+    app.add_template_global(cover_url)
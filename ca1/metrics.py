@@ -0,0 +1,193 @@
+"""
+Per-request SQL and template instrumentation
+
+Every connection from database.py is an InstrumentedConnection, so each statement a
+request runs is timed and counted, along with the rows fetched from it. Statements
+slower than app.config["SLOW_QUERY_MS"] are logged with their EXPLAIN QUERY PLAN,
+and flagged if the plan scans a whole table.
+
+Each response gets a Server-Timing header (and X-SQL-* headers) with the request's
+query count, SQL time, rows fetched and template render time. Totals for each
+endpoint since the worker started are served in the Prometheus text format by
+/admin/metrics. Counters are per worker process.
+"""
+
+from flask import g, has_app_context, current_app, request, template_rendered, before_render_template
+from collections import defaultdict
+import re
+import sqlite3
+import threading
+import time
+
+
+SLOW_QUERY_MS = 100
+
+# A plan line like "SCAN games" (but not "SCAN games USING INDEX ...") reads every row
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)$")
+
+COUNTERS = [
+    ("requests_total", "Requests handled"),
+    ("sql_queries_total", "SQL statements executed"),
+    ("sql_seconds_total", "Time spent executing SQL and fetching rows"),
+    ("sql_rows_total", "Rows fetched from SQL statements"),
+    ("render_seconds_total", "Time spent rendering templates"),
+    ("slow_queries_total", "SQL statements slower than SLOW_QUERY_MS"),
+    ("full_scans_total", "Slow SQL statements whose plan scans a whole table"),
+]
+
+_lock = threading.Lock()
+# {counter name: {endpoint: value}}
+_counters = defaultdict(lambda: defaultdict(float))
+
+
+def request_stats():
+    if not has_app_context():
+        return None
+    stats = g.get("sql_stats")
+    if stats is None:
+        stats = g.sql_stats = {"queries": 0, "sql_seconds": 0.0, "rows": 0,
+                               "render_seconds": 0.0, "slow_queries": 0, "full_scans": 0}
+    return stats
+
+
+def record_query(db, sql, parameters, elapsed):
+    stats = request_stats()
+    if stats is None:
+        return
+    stats["queries"] += 1
+    stats["sql_seconds"] += elapsed
+    slow_query_ms = current_app.config.get("SLOW_QUERY_MS", SLOW_QUERY_MS)
+    if slow_query_ms is not None and elapsed * 1000 >= slow_query_ms:
+        stats["slow_queries"] += 1
+        explain_slow_query(db, sql, parameters, elapsed, stats)
+
+
+def record_fetch(num_rows, elapsed):
+    stats = request_stats()
+    if stats is None:
+        return
+    stats["rows"] += num_rows
+    stats["sql_seconds"] += elapsed
+
+
+def explain_slow_query(db, sql, parameters, elapsed, stats):
+    statement = sql.strip()
+    plan = []
+    if statement.split(None, 1)[0].upper() in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE"):
+        try:
+            # A plain cursor, so explaining is not itself recorded
+            plan = [row[3] for row in sqlite3.Cursor(db).execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+        except sqlite3.Error:
+            pass
+    scanned = [FULL_SCAN.match(line.strip()).group(1) for line in plan if FULL_SCAN.match(line.strip())]
+    if scanned != []:
+        stats["full_scans"] += 1
+    current_app.logger.warning("Slow query (%.1fms)%s: %s\n%s", elapsed * 1000,
+                               " FULL SCAN of " + ", ".join(scanned) if scanned != [] else "",
+                               " ".join(statement.split()), "\n".join(plan))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(self.connection, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(self.connection, sql, (), time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        record_fetch(0 if row is None else 1, time.perf_counter() - start)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        record_fetch(len(rows), time.perf_counter() - start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        record_fetch(len(rows), time.perf_counter() - start)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            record_fetch(0, time.perf_counter() - start)
+            raise
+        record_fetch(1, time.perf_counter() - start)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def start_render(sender, template, context, **extra):
+    if has_app_context():
+        g.setdefault("render_starts", []).append(time.perf_counter())
+
+
+def end_render(sender, template, context, **extra):
+    starts = g.get("render_starts") if has_app_context() else None
+    if starts:
+        stats = request_stats()
+        stats["render_seconds"] += time.perf_counter() - starts.pop()
+
+
+def add_timing_headers(response):
+    stats = request_stats()
+    endpoint = request.endpoint or "none"
+    with _lock:
+        _counters["requests_total"][endpoint] += 1
+        _counters["sql_queries_total"][endpoint] += stats["queries"]
+        _counters["sql_seconds_total"][endpoint] += stats["sql_seconds"]
+        _counters["sql_rows_total"][endpoint] += stats["rows"]
+        _counters["render_seconds_total"][endpoint] += stats["render_seconds"]
+        _counters["slow_queries_total"][endpoint] += stats["slow_queries"]
+        _counters["full_scans_total"][endpoint] += stats["full_scans"]
+    if current_app.config.get("METRICS_HEADERS", True):
+        response.headers["Server-Timing"] = 'sql;dur=%.2f;desc="%d queries", render;dur=%.2f' % (
+            stats["sql_seconds"] * 1000, stats["queries"], stats["render_seconds"] * 1000)
+        response.headers["X-SQL-Queries"] = str(stats["queries"])
+        response.headers["X-SQL-Rows"] = str(stats["rows"])
+    return response
+
+
+def init_app(app):
+    app.after_request(add_timing_headers)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(end_render, app)
+
+
+# All counters in the Prometheus text exposition format
+def prometheus_text():
+    lines = []
+    with _lock:
+        for name, description in COUNTERS:
+            lines.append("# HELP ca1_" + name + " " + description)
+            lines.append("# TYPE ca1_" + name + " counter")
+            for endpoint, value in sorted(_counters[name].items()):
+                lines.append('ca1_%s{endpoint="%s"} %s' % (name, endpoint, repr(value)))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,134 @@
+"""
+Profanity filter for review text and user names
+
+All censored words are compiled into one regular expression, shaped like a trie
+(words sharing a prefix share a branch), so checking a review is a single pass over
+its text however long the word list is.
+
+The words are read from the file in app.config["CENSORED_WORDS_FILE"], one per line
+("#" starts a comment). The file is checked for changes every few seconds and the
+filter rebuilt, so the list can be edited without restarting the app.
+Options in app.config:
+- CENSOR_WHOLE_WORDS: only match whole words instead of anywhere in the text
+- CENSOR_LEET_SPEAK: also match common letter swaps such as "5h1t"
+"""
+
+from flask import current_app
+import os
+import re
+import threading
+import time
+
+
+WORD_LIST = os.path.join(os.path.abspath(os.path.dirname(__file__)), "censored_words.txt")
+
+# Seconds between checks for changes to the word list file
+RELOAD_INTERVAL = 5
+
+# Characters commonly swapped for letters, e.g. "sh1t"
+LEET_SPEAK = str.maketrans({"0": "o", "1": "i", "!": "i", "3": "e", "4": "a",
+                            "@": "a", "5": "s", "$": "s", "7": "t"})
+
+
+# Builds a regex matching any of words, e.g. ["cat", "car", "dog"] becomes "(?:ca(?:r|t)|dog)"
+def trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        # Marks the end of a word
+        node[""] = {}
+    return node_pattern(trie)
+
+
+def node_pattern(node):
+    branches = [re.escape(char) + node_pattern(child)
+                for char, child in sorted(node.items()) if char != ""]
+    if branches == []:
+        return ""
+    if len(branches) == 1 and "" not in node:
+        return branches[0]
+    pattern = "(?:" + "|".join(branches) + ")"
+    # A word also ends here, so the rest is optional
+    if "" in node:
+        pattern += "?"
+    return pattern
+
+
+class WordFilter:
+
+    def __init__(self, words, whole_words=False, leet_speak=False):
+        self.words = sorted({word.strip().lower() for word in words if word.strip() != ""})
+        self.leet_speak = leet_speak
+        self.regex = None
+        if self.words != []:
+            pattern = trie_pattern(self.words)
+            if whole_words:
+                pattern = r"\b" + pattern + r"\b"
+            self.regex = re.compile(pattern)
+
+    def normalise(self, text):
+        text = text.lower()
+        if self.leet_speak:
+            text = text.translate(LEET_SPEAK)
+        return text
+
+    def contains(self, text):
+        if self.regex is None:
+            return False
+        return self.regex.search(self.normalise(text)) is not None
+
+    # Every censored word found in text, in the order they appear
+    def find(self, text):
+        if self.regex is None:
+            return []
+        return self.regex.findall(self.normalise(text))
+
+
+def read_word_list(path):
+    with open(path, encoding="utf-8") as file:
+        return [line.split("#", 1)[0] for line in file]
+
+
+_lock = threading.Lock()
+_loaded = {"key": None, "filter": None, "checked": 0}
+
+
+# The filter for the current word list and options, rebuilt when either changes
+def get_word_filter():
+    path = current_app.config.get("CENSORED_WORDS_FILE", WORD_LIST)
+    whole_words = current_app.config.get("CENSOR_WHOLE_WORDS", False)
+    leet_speak = current_app.config.get("CENSOR_LEET_SPEAK", False)
+    now = time.monotonic()
+    key = _loaded["key"]
+    # Only looks at the file every RELOAD_INTERVAL seconds
+    if key is not None and key[0] == path and key[2:] == (whole_words, leet_speak) \
+            and now - _loaded["checked"] < RELOAD_INTERVAL:
+        return _loaded["filter"]
+    with _lock:
+        key = (path, os.stat(path).st_mtime_ns, whole_words, leet_speak)
+        if key != _loaded["key"]:
+            _loaded["filter"] = WordFilter(read_word_list(path), whole_words, leet_speak)
+            _loaded["key"] = key
+        _loaded["checked"] = now
+        return _loaded["filter"]
+
+
+# Re-scans every existing review against word_filter, batch_size rows at a time
+# Yields (review_id, user_id, words found) for each review that would now be censored
+def scan_reviews(db, word_filter, batch_size=1000):
+    last_id = -1
+    while True:
+        reviews = db.execute("""SELECT review_id, user_id, description
+                            FROM reviews
+                            WHERE review_id > ?
+                            ORDER BY review_id
+                            LIMIT ?;""", (last_id, batch_size)).fetchall()
+        if reviews == []:
+            return
+        for review in reviews:
+            found = word_filter.find(review["description"] or "")
+            if found != []:
+                yield review["review_id"], review["user_id"], found
+        last_id = reviews[-1]["review_id"]
@@ -0,0 +1,125 @@
+"""
+Keyset (cursor) pagination for the long listings
+
+Instead of fetching every row, each page fetches PAGE_SIZE rows that sort after
+the last row of the previous page. The page token is that row's sort key, so
+reviews or games inserted while someone is paging never shift or repeat rows
+the way LIMIT/OFFSET would, and every page costs the same no matter how deep.
+
+Every ordering ends in a unique id so the sort key identifies exactly one row,
+and each has a matching index created by create_pagination_indexes.
+"""
+
+from werkzeug.exceptions import BadRequest
+from genres import in_genre
+from search import matching
+import base64
+import json
+
+
+PAGE_SIZE = 30
+
+# Sort keys for each discover ordering, in the same order as the discover route
+# avg_score is NULL for games without reviews, COALESCE keeps them in the last page
+GAME_ORDERINGS = [
+    (["release_date", "game_id"], True),
+    (["name", "game_id"], False),
+    (["COALESCE(avg_score, -1)", "game_id"], True),
+]
+
+PAGINATION_INDEXES = """
+CREATE INDEX IF NOT EXISTS games_by_release_date ON games (release_date DESC, game_id DESC);
+CREATE INDEX IF NOT EXISTS games_by_name ON games (name, game_id);
+CREATE INDEX IF NOT EXISTS games_by_avg_score ON games (COALESCE(avg_score, -1) DESC, game_id DESC);
+CREATE INDEX IF NOT EXISTS reviews_by_game ON reviews (game_id, review_id);
+"""
+
+
+def create_pagination_indexes(db):
+    db.executescript(PAGINATION_INDEXES)
+
+
+def encode_cursor(values):
+    # Dates come back as date objects because of PARSE_DECLTYPES, but are stored as text
+    values = [value.isoformat() if hasattr(value, "isoformat") else value for value in values]
+    token = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip("=")
+
+
+def decode_cursor(token, num_keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        raise BadRequest("Invalid page token")
+    if not isinstance(values, list) or len(values) != num_keys or \
+            not all(isinstance(value, (str, int, float)) for value in values):
+        raise BadRequest("Invalid page token")
+    return values
+
+
+# Fetches one page of "SELECT columns FROM tables WHERE where", sorted by sort_keys
+# Returns the rows and the token for the next page (None on the last page)
+def fetch_page(db, columns, tables, sort_keys, descending, after=None, where=(), params=(), page_size=PAGE_SIZE):
+    conditions = list(where)
+    params = list(params)
+    compare = "<" if descending else ">"
+    if after is not None:
+        values = decode_cursor(after, len(sort_keys))
+        # The bound on the first key alone lets SQLite seek into the index,
+        # the row value comparison then skips rows already shown with the same first key
+        conditions.append(sort_keys[0] + " " + compare + "= ?")
+        conditions.append("(" + ", ".join(sort_keys) + ") " + compare +
+                          " (" + ", ".join("?" * len(sort_keys)) + ")")
+        params += [values[0]] + values
+    page_keys = [key + " AS page_key_" + str(i) for i, key in enumerate(sort_keys)]
+    direction = " DESC" if descending else " ASC"
+    query = "SELECT " + columns + ", " + ", ".join(page_keys) + " FROM " + tables
+    if conditions != []:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY " + ", ".join(key + direction for key in sort_keys) + " LIMIT ?;"
+    # Fetches one extra row to know if there is another page
+    rows = db.execute(query, params + [page_size + 1]).fetchall()
+    next_page = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_page = encode_cursor([rows[-1]["page_key_" + str(i)] for i in range(len(sort_keys))])
+    return rows, next_page
+
+
+# A page of games for the discover page, order is the index into GAME_ORDERINGS
+# Only games in genre and matching search are included, if they are given
+def page_games(db, order, after=None, genre=None, columns="*", search=None):
+    sort_keys, descending = GAME_ORDERINGS[order]
+    where = []
+    params = []
+    if genre is not None:
+        condition, genre_params = in_genre(genre)
+        where.append(condition)
+        params += genre_params
+    if search is not None:
+        condition, search_params = matching(search)
+        where.append(condition)
+        params += search_params
+    return fetch_page(db, columns, "games", sort_keys, descending, after, where, params)
+
+
+# A page of games in game_id order for the delete game form
+def page_games_by_id(db, after=None):
+    return fetch_page(db, "*", "games", ["game_id"], False, after)
+
+
+# A page of reviews joined with their game, ordered by game
+def page_reviews(db, after=None):
+    return fetch_page(db, "*", """reviews AS r
+                        JOIN games AS g
+                        ON g.game_id = r.game_id""", ["r.game_id", "r.review_id"], False, after)
+
+
+# A page of one game's reviews, newest first
+def page_game_reviews(db, game_id, after=None, columns="*"):
+    return fetch_page(db, columns, "reviews", ["review_id"], True, after, ["game_id = ?"], [game_id])
+
+
+# A page of one user's reviews, newest first
+def page_user_reviews(db, user_id, after=None, columns="*"):
+    return fetch_page(db, columns, "reviews", ["review_id"], True, after, ["user_id = ?"], [user_id])
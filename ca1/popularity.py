@@ -0,0 +1,145 @@
+"""
+Featured and trending games for the home page
+
+game_popularity has a row for each reviewed game with its number of reviews and a
+trending score, kept up to date by triggers on reviews like the ones in ratings.py.
+Games with at least FEATURED_MIN_REVIEWS reviews are marked featured, and the home
+page reads the most trending featured games straight from an index, however many
+reviews there are.
+
+A review's weight in the trending score halves every TRENDING_HALF_LIFE_DAYS days
+after it was written. Rather than decaying every score each day, each review adds
+2 ** ((review date - epoch) / half life) to its game's score: newer reviews add more,
+and since every score would be scaled down by the same amount over time, the order
+is the same as with decayed scores. These numbers double every half life, so the
+epoch is moved forward (and the scores rebuilt) once it is REBASE_AFTER half lives
+old, long before they could overflow.
+
+The thresholds live in the popularity_settings row so the triggers can read them,
+configure_popularity copies them from app.config on startup and rebuilds the scores
+if they changed. After bulk changes with the triggers missing use "flask rebuild-popularity".
+"""
+
+from datetime import date
+import math
+import sqlite3
+
+
+FEATURED_MIN_REVIEWS = 3
+TRENDING_HALF_LIFE_DAYS = 14
+FEATURED_LIMIT = 30
+
+# The epoch is moved once scores reach 2 ** REBASE_AFTER, floats overflow at 2 ** 1024
+REBASE_AFTER = 400
+
+# The weight of review NEW (or OLD) in its game's trending score
+REVIEW_WEIGHT = """
+COALESCE((SELECT pow(2.0, (julianday({review}.date) - julianday(epoch)) / half_life_days)
+          FROM popularity_settings), 0)"""
+
+MIN_REVIEWS = """(SELECT min_reviews FROM popularity_settings)"""
+
+POPULARITY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS popularity_settings (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    min_reviews INTEGER NOT NULL,
+    half_life_days REAL NOT NULL,
+    epoch DATE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS game_popularity (
+    game_id INTEGER PRIMARY KEY REFERENCES games (game_id) ON DELETE CASCADE,
+    num_reviews INTEGER NOT NULL DEFAULT 0,
+    trending REAL NOT NULL DEFAULT 0,
+    featured INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS game_popularity_by_trending ON game_popularity (featured, trending DESC);
+
+CREATE TRIGGER IF NOT EXISTS popularity_after_review_insert
+AFTER INSERT ON reviews
+BEGIN
+    INSERT INTO game_popularity (game_id, num_reviews, trending, featured)
+    VALUES (NEW.game_id, 1, {new_weight}, 1 >= {min_reviews})
+    ON CONFLICT (game_id) DO UPDATE SET
+        num_reviews = num_reviews + 1,
+        trending = trending + excluded.trending,
+        featured = num_reviews + 1 >= {min_reviews};
+END;
+
+CREATE TRIGGER IF NOT EXISTS popularity_after_review_delete
+AFTER DELETE ON reviews
+BEGIN
+    UPDATE game_popularity SET
+        num_reviews = num_reviews - 1,
+        trending = MAX(trending - {old_weight}, 0),
+        featured = num_reviews - 1 >= {min_reviews}
+    WHERE game_id = OLD.game_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS popularity_after_review_update
+AFTER UPDATE OF game_id, date ON reviews
+BEGIN
+    UPDATE game_popularity SET
+        num_reviews = num_reviews - 1,
+        trending = MAX(trending - {old_weight}, 0),
+        featured = num_reviews - 1 >= {min_reviews}
+    WHERE game_id = OLD.game_id;
+    INSERT INTO game_popularity (game_id, num_reviews, trending, featured)
+    VALUES (NEW.game_id, 1, {new_weight}, 1 >= {min_reviews})
+    ON CONFLICT (game_id) DO UPDATE SET
+        num_reviews = num_reviews + 1,
+        trending = trending + excluded.trending,
+        featured = num_reviews + 1 >= {min_reviews};
+END;
+""".format(new_weight=REVIEW_WEIGHT.format(review="NEW"),
+           old_weight=REVIEW_WEIGHT.format(review="OLD"),
+           min_reviews=MIN_REVIEWS)
+
+
+# SQLite is not always built with its math functions, the triggers need pow
+def create_math_functions(db):
+    try:
+        db.execute("""SELECT pow(2, 1);""")
+    except sqlite3.OperationalError:
+        db.create_function("pow", 2, math.pow, deterministic=True)
+
+
+def configure_popularity(db, min_reviews=FEATURED_MIN_REVIEWS, half_life_days=TRENDING_HALF_LIFE_DAYS):
+    db.executescript(POPULARITY_SCHEMA)
+    settings = db.execute("""SELECT min_reviews, half_life_days,
+                            (julianday('now') - julianday(epoch)) / half_life_days AS age
+                            FROM popularity_settings;""").fetchone()
+    if (settings is not None and settings["min_reviews"] == min_reviews
+            and settings["half_life_days"] == half_life_days and settings["age"] < REBASE_AFTER):
+        return
+    db.execute("""INSERT INTO popularity_settings (id, min_reviews, half_life_days, epoch)
+                VALUES (1, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    min_reviews = excluded.min_reviews,
+                    half_life_days = excluded.half_life_days,
+                    epoch = excluded.epoch;""", (min_reviews, half_life_days, date.today().isoformat()))
+    rebuild_popularity(db)
+    db.commit()
+
+
+def rebuild_popularity(db):
+    db.execute("""DELETE FROM game_popularity;""")
+    db.execute("""INSERT INTO game_popularity (game_id, num_reviews, trending, featured)
+                SELECT r.game_id, COUNT(*),
+                    TOTAL(pow(2.0, (julianday(r.date) - julianday(s.epoch)) / s.half_life_days)),
+                    COUNT(*) >= s.min_reviews
+                FROM reviews AS r, popularity_settings AS s
+                WHERE r.game_id IN (SELECT game_id FROM games)
+                GROUP BY r.game_id;""")
+
+
+# The most trending games with enough reviews, most trending first
+def featured_games(db, limit=FEATURED_LIMIT):
+    return db.execute("""SELECT games.*
+                        FROM game_popularity AS p
+                        JOIN games
+                        ON games.game_id = p.game_id
+                        WHERE p.featured = 1
+                        ORDER BY p.trending DESC
+                        LIMIT ?;""", (limit,)).fetchall()
@@ -0,0 +1,169 @@
+"""
+Running rating aggregates for each game
+
+Instead of recomputing AVG(score) over every review of a game whenever a review is
+written or deleted, the reviews table has triggers which keep:
+- game_ratings: the number of reviews and the sum of their scores for each game
+- game_score_counts: how many reviews gave each score (1-10) for each game
+and copy the new average into games.avg_score, which is NULL for a game without
+reviews. These run in the same transaction
+as the review insert/delete and only touch the rows for that one game.
+
+After bulk imports (or any change made with the triggers missing) use the
+"flask rebuild-ratings" and "flask verify-ratings" commands in app.py
+"""
+
+
+RATINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS game_ratings (
+    game_id INTEGER PRIMARY KEY,
+    num_reviews INTEGER NOT NULL DEFAULT 0,
+    total_score INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS game_score_counts (
+    game_id INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    num_reviews INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (game_id, score)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS ratings_after_review_insert
+AFTER INSERT ON reviews
+BEGIN
+    INSERT INTO game_ratings (game_id, num_reviews, total_score)
+    VALUES (NEW.game_id, 1, NEW.score)
+    ON CONFLICT (game_id) DO UPDATE SET
+        num_reviews = num_reviews + 1,
+        total_score = total_score + NEW.score;
+    INSERT INTO game_score_counts (game_id, score, num_reviews)
+    VALUES (NEW.game_id, NEW.score, 1)
+    ON CONFLICT (game_id, score) DO UPDATE SET
+        num_reviews = num_reviews + 1;
+    UPDATE games SET avg_score = (
+        SELECT ROUND(total_score * 10.0 / NULLIF(num_reviews, 0), 0)
+        FROM game_ratings
+        WHERE game_id = NEW.game_id)
+    WHERE game_id = NEW.game_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS ratings_after_review_delete
+AFTER DELETE ON reviews
+BEGIN
+    UPDATE game_ratings SET
+        num_reviews = num_reviews - 1,
+        total_score = total_score - OLD.score
+    WHERE game_id = OLD.game_id;
+    UPDATE game_score_counts SET num_reviews = num_reviews - 1
+    WHERE game_id = OLD.game_id AND score = OLD.score;
+    UPDATE games SET avg_score = (
+        SELECT ROUND(total_score * 10.0 / NULLIF(num_reviews, 0), 0)
+        FROM game_ratings
+        WHERE game_id = OLD.game_id)
+    WHERE game_id = OLD.game_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS ratings_after_review_update
+AFTER UPDATE OF game_id, score ON reviews
+BEGIN
+    UPDATE game_ratings SET
+        num_reviews = num_reviews - 1,
+        total_score = total_score - OLD.score
+    WHERE game_id = OLD.game_id;
+    UPDATE game_score_counts SET num_reviews = num_reviews - 1
+    WHERE game_id = OLD.game_id AND score = OLD.score;
+    INSERT INTO game_ratings (game_id, num_reviews, total_score)
+    VALUES (NEW.game_id, 1, NEW.score)
+    ON CONFLICT (game_id) DO UPDATE SET
+        num_reviews = num_reviews + 1,
+        total_score = total_score + NEW.score;
+    INSERT INTO game_score_counts (game_id, score, num_reviews)
+    VALUES (NEW.game_id, NEW.score, 1)
+    ON CONFLICT (game_id, score) DO UPDATE SET
+        num_reviews = num_reviews + 1;
+    UPDATE games SET avg_score = (
+        SELECT ROUND(total_score * 10.0 / NULLIF(num_reviews, 0), 0)
+        FROM game_ratings
+        WHERE game_id = games.game_id)
+    WHERE game_id IN (OLD.game_id, NEW.game_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS ratings_after_game_delete
+AFTER DELETE ON games
+BEGIN
+    DELETE FROM game_ratings WHERE game_id = OLD.game_id;
+    DELETE FROM game_score_counts WHERE game_id = OLD.game_id;
+END;
+"""
+
+
+def create_ratings_tables(db):
+    db.executescript(RATINGS_SCHEMA)
+    # add_game used to store the string "None", which sorted above every score
+    db.execute("""UPDATE games SET avg_score = NULL WHERE avg_score = 'None';""")
+    db.commit()
+    # Fills the aggregates the first time they are created on an existing database
+    empty = db.execute("""SELECT NOT EXISTS (SELECT 1 FROM game_ratings)
+                        AND EXISTS (SELECT 1 FROM reviews);""").fetchone()[0]
+    if empty:
+        rebuild_ratings(db)
+        db.commit()
+
+
+# Recomputes every aggregate from the reviews table in a few set-based statements
+def rebuild_ratings(db):
+    db.execute("""DELETE FROM game_ratings;""")
+    db.execute("""DELETE FROM game_score_counts;""")
+    db.execute("""INSERT INTO game_ratings (game_id, num_reviews, total_score)
+                SELECT game_id, COUNT(*), SUM(score)
+                FROM reviews
+                GROUP BY game_id;""")
+    db.execute("""INSERT INTO game_score_counts (game_id, score, num_reviews)
+                SELECT game_id, score, COUNT(*)
+                FROM reviews
+                GROUP BY game_id, score;""")
+    db.execute("""UPDATE games SET avg_score = (
+                    SELECT ROUND(total_score * 10.0 / NULLIF(num_reviews, 0), 0)
+                    FROM game_ratings
+                    WHERE game_ratings.game_id = games.game_id);""")
+
+
+# Returns the ids of games whose aggregates do not match their reviews
+def verify_ratings(db):
+    mismatched = db.execute("""
+        SELECT actual.game_id
+        FROM (SELECT game_id, COUNT(*) AS num_reviews, SUM(score) AS total_score
+              FROM reviews
+              GROUP BY game_id) AS actual
+        LEFT JOIN game_ratings AS r
+        ON r.game_id = actual.game_id
+        WHERE r.game_id IS NULL
+        OR r.num_reviews != actual.num_reviews
+        OR r.total_score != actual.total_score
+        UNION
+        SELECT r.game_id
+        FROM game_ratings AS r
+        WHERE r.num_reviews != 0
+        AND NOT EXISTS (SELECT 1 FROM reviews WHERE game_id = r.game_id)
+        UNION
+        SELECT actual.game_id
+        FROM (SELECT game_id, score, COUNT(*) AS num_reviews
+              FROM reviews
+              GROUP BY game_id, score) AS actual
+        LEFT JOIN game_score_counts AS c
+        ON c.game_id = actual.game_id AND c.score = actual.score
+        WHERE c.game_id IS NULL OR c.num_reviews != actual.num_reviews
+        UNION
+        SELECT c.game_id
+        FROM game_score_counts AS c
+        WHERE c.num_reviews != 0
+        AND NOT EXISTS (SELECT 1 FROM reviews
+                        WHERE game_id = c.game_id AND score = c.score)
+        UNION
+        SELECT g.game_id
+        FROM games AS g
+        JOIN game_ratings AS r
+        ON r.game_id = g.game_id
+        WHERE g.avg_score IS NOT ROUND(r.total_score * 10.0 / NULLIF(r.num_reviews, 0), 0)
+        ORDER BY 1;""").fetchall()
+    return [row[0] for row in mismatched]
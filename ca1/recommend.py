@@ -0,0 +1,261 @@
+"""
+Recommended games, from which games the same users liked
+
+"flask build-recommendations" (run it from cron, e.g. hourly) builds the user x game
+matrix of review scores with SciPy's sparse matrices and works out how similar every
+pair of games is: the cosine of their columns, after taking each user's average off
+their scores, so a game counts as liked if its user scored it above their usual.
+A user's average is taken with one extra score of MIDPOINT, the middle of the scale,
+so a user with a single review still liked or disliked that game. Pairs reviewed by
+fewer than MIN_CO_REVIEWS of the same users are left out, and the SIMILAR_PER_GAME
+most similar games of each game are saved in game_similarity. NumPy and SciPy are
+only needed by the build, the app itself only reads the tables.
+
+The game page lists the most similar games to it ("players who liked this also
+liked"). A user's recommendations are the games they have not reviewed, scored by
+how similar each is to the games they liked (or disliked, which counts against it).
+They are saved in user_recommendations, which the profile page only reads. Writing a
+review works out the writer's again in the same transaction; anything else that
+changes a user's reviews (an admin deleting a review or a game) takes them off
+recommendations_fresh with the triggers below, and a build makes everyone's stale.
+"flask build-recommendations" then works out every stale user's again, in batches of
+REFRESH_BATCH users per transaction, even when --if-changed skips the build itself.
+
+--if-changed compares the "games" change counter (see changes.py), which moves when a
+review is written or deleted or its score, game or user changes, but not on votes.
+The scores are read from the database SCORE_CHUNK rows at a time into NumPy arrays,
+so the build never holds them all as Python rows.
+"""
+
+from changes import get_counter
+
+
+SIMILAR_PER_GAME = 20
+MIN_CO_REVIEWS = 2
+MIDPOINT = 5.5
+SCORE_CHUNK = 10000
+REFRESH_BATCH = 100
+
+RECOMMEND_SCHEMA = """
+CREATE TABLE IF NOT EXISTS game_similarity (
+    game_id INTEGER NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+    similar_game_id INTEGER NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+    similarity REAL NOT NULL,
+    PRIMARY KEY (game_id, similar_game_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS game_similarity_by_similar_game ON game_similarity (similar_game_id);
+
+CREATE TABLE IF NOT EXISTS user_recommendations (
+    user_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+    game_id INTEGER NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+    score REAL NOT NULL,
+    PRIMARY KEY (user_id, game_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS user_recommendations_by_game ON user_recommendations (game_id);
+
+CREATE TABLE IF NOT EXISTS recommendations_fresh (
+    user_id TEXT PRIMARY KEY REFERENCES users (user_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS recommendation_builds (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    games_version INTEGER NOT NULL,
+    built_at TIMESTAMP NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS recommendations_after_review_insert
+AFTER INSERT ON reviews
+BEGIN
+    DELETE FROM recommendations_fresh WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recommendations_after_review_update
+AFTER UPDATE OF user_id, game_id, score ON reviews
+BEGIN
+    DELETE FROM recommendations_fresh WHERE user_id IN (OLD.user_id, NEW.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS recommendations_after_review_delete
+AFTER DELETE ON reviews
+BEGIN
+    DELETE FROM recommendations_fresh WHERE user_id = OLD.user_id;
+END;
+"""
+
+
+def create_recommendation_tables(db):
+    db.executescript(RECOMMEND_SCHEMA)
+
+
+# Each user's score for each game they reviewed, averaged if they reviewed it more than once
+# Returns a cursor, to be read chunk by chunk
+def user_game_scores(db):
+    return db.execute("""SELECT user_id, game_id, AVG(score) AS score
+                        FROM reviews
+                        GROUP BY user_id, game_id;""")
+
+
+# Reads user_game_scores into arrays of (user index, game_id, score), chunk rows at a time
+def read_scores(db, chunk=SCORE_CHUNK):
+    import numpy
+
+    cursor = user_game_scores(db)
+    user_index = {}
+    users, game_ids, scores = [], [], []
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if rows == []:
+            break
+        users.append(numpy.fromiter((user_index.setdefault(row["user_id"], len(user_index)) for row in rows),
+                                    dtype=numpy.int64, count=len(rows)))
+        game_ids.append(numpy.fromiter((row["game_id"] for row in rows), dtype=numpy.int64, count=len(rows)))
+        scores.append(numpy.fromiter((row["score"] for row in rows), dtype=float, count=len(rows)))
+    if users == []:
+        return None
+    return numpy.concatenate(users), numpy.concatenate(game_ids), numpy.concatenate(scores)
+
+
+# Returns the game_similarity rows (game_id, similar_game_id, similarity) for the reviews in db
+def build_similarity(db, per_game=SIMILAR_PER_GAME, min_co_reviews=MIN_CO_REVIEWS):
+    # Only the build needs these, so the app can run without them
+    import numpy
+    from scipy import sparse
+
+    read = read_scores(db)
+    if read is None:
+        return []
+    users, reviewed_game_ids, scores = read
+    game_ids, games = numpy.unique(reviewed_game_ids, return_inverse=True)
+    shape = (users.max() + 1, len(game_ids))
+
+    means = (numpy.bincount(users, weights=scores) + MIDPOINT) / (numpy.bincount(users) + 1)
+    liked = sparse.csr_matrix((scores - means[users], (users, games)), shape=shape)
+    reviewed = sparse.csr_matrix((numpy.ones(len(scores)), (users, games)), shape=shape)
+
+    # Cosine similarity of the columns, for pairs with enough users in common
+    norms = numpy.sqrt(numpy.asarray(liked.multiply(liked).sum(axis=0)).ravel())
+    inverse_norms = sparse.diags(numpy.divide(1.0, norms, out=numpy.zeros_like(norms), where=norms > 0))
+    similarity = inverse_norms @ (liked.T @ liked) @ inverse_norms
+    similarity = similarity.multiply((reviewed.T @ reviewed) >= min_co_reviews).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    similar = []
+    for game in range(len(game_ids)):
+        start, end = similarity.indptr[game], similarity.indptr[game + 1]
+        others = similarity.indices[start:end]
+        values = similarity.data[start:end]
+        keep = values > 0
+        others, values = others[keep], values[keep]
+        if len(values) > per_game:
+            best = numpy.argpartition(-values, per_game)[:per_game]
+            others, values = others[best], values[best]
+        similar += [(int(game_ids[game]), int(game_ids[other]), float(value))
+                    for other, value in zip(others, values)]
+    return similar
+
+
+# Rebuilds game_similarity in one transaction, which makes every user's recommendations stale
+# If only_if_changed, does nothing unless a game or review has changed since the last build
+# Returns whether it was rebuilt
+def rebuild_recommendations(db, only_if_changed=False):
+    games_version, _ = get_counter(db, "games")
+    last_build = db.execute("""SELECT games_version FROM recommendation_builds;""").fetchone()
+    if only_if_changed and last_build is not None and last_build["games_version"] == games_version:
+        return False
+    similar = build_similarity(db)
+    db.execute("""BEGIN IMMEDIATE;""")
+    try:
+        db.execute("""DELETE FROM game_similarity;""")
+        # Games deleted since the scores were read are left out
+        db.executemany("""INSERT INTO game_similarity (game_id, similar_game_id, similarity)
+                        SELECT ?1, ?2, ?3
+                        WHERE EXISTS (SELECT 1 FROM games WHERE game_id = ?1)
+                        AND EXISTS (SELECT 1 FROM games WHERE game_id = ?2);""", similar)
+        forget_recommendations(db)
+        db.execute("""INSERT INTO recommendation_builds (id, games_version, built_at)
+                    VALUES (1, ?, datetime('now'))
+                    ON CONFLICT (id) DO UPDATE SET
+                        games_version = excluded.games_version,
+                        built_at = excluded.built_at;""", (games_version,))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return True
+
+
+# Makes every user's recommendations stale, after changes made with the triggers missing (see bulk.py)
+def forget_recommendations(db):
+    db.execute("""DELETE FROM recommendations_fresh;""")
+
+
+# Works out the user's recommendations again from game_similarity, does not commit
+def refresh_recommendations(db, user_id, limit):
+    db.execute("""DELETE FROM user_recommendations WHERE user_id = ?;""", (user_id,))
+    db.execute("""INSERT INTO user_recommendations (user_id, game_id, score)
+                WITH mine AS (
+                    SELECT game_id, AVG(score) AS score
+                    FROM reviews
+                    WHERE user_id = :user_id
+                    GROUP BY game_id
+                ), usual AS (
+                    SELECT (TOTAL(score) + :midpoint) / (COUNT(*) + 1) AS score FROM mine
+                )
+                SELECT :user_id, s.similar_game_id, TOTAL(s.similarity * (mine.score - usual.score)) AS predicted
+                FROM mine
+                JOIN usual
+                JOIN game_similarity AS s
+                ON s.game_id = mine.game_id
+                WHERE s.similar_game_id NOT IN (SELECT game_id FROM mine)
+                GROUP BY s.similar_game_id
+                HAVING predicted > 0
+                ORDER BY predicted DESC
+                LIMIT :limit;""", {"user_id": user_id, "midpoint": MIDPOINT, "limit": limit})
+    db.execute("""INSERT INTO recommendations_fresh (user_id) VALUES (?)
+                ON CONFLICT (user_id) DO NOTHING;""", (user_id,))
+
+
+# Works out every stale user's recommendations again, committing every batch users
+# Returns how many were worked out
+def refresh_stale_recommendations(db, limit, batch=REFRESH_BATCH):
+    refreshed = 0
+    while True:
+        stale = db.execute("""SELECT user_id FROM users
+                            WHERE user_id NOT IN (SELECT user_id FROM recommendations_fresh)
+                            LIMIT ?;""", (batch,)).fetchall()
+        if stale == []:
+            return refreshed
+        db.execute("""BEGIN IMMEDIATE;""")
+        try:
+            for user in stale:
+                refresh_recommendations(db, user["user_id"], limit)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        refreshed += len(stale)
+
+
+# The user's saved recommended games, best first
+def recommended_games(db, user_id, limit):
+    return db.execute("""SELECT games.*
+                        FROM user_recommendations AS r
+                        JOIN games
+                        ON games.game_id = r.game_id
+                        WHERE r.user_id = ?
+                        ORDER BY r.score DESC
+                        LIMIT ?;""", (user_id, limit)).fetchall()
+
+
+# The games most similar to game_id, most similar first
+def similar_games(db, game_id, limit):
+    return db.execute("""SELECT games.*
+                        FROM game_similarity AS s
+                        JOIN games
+                        ON games.game_id = s.similar_game_id
+                        WHERE s.game_id = ?
+                        ORDER BY s.similarity DESC
+                        LIMIT ?;""", (game_id, limit)).fetchall()
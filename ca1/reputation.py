@@ -0,0 +1,62 @@
+"""
+Per-user review statistics
+
+Every query here is a single GROUP BY over reviews (using the reviews_by_user
+covering index), rather than one query per user. Used by delete_user for the list
+of unhelpful users, by profile, and by see_users.
+
+The unhelpful user thresholds are read from app.config:
+- UNHELPFUL_MAX_HELPFULNESS: average helpfulness at or below this is unhelpful
+- UNHELPFUL_MIN_REVIEWS: only users with at least this many reviews are listed
+"""
+
+from flask import current_app
+
+
+REPUTATION_INDEXES = """
+CREATE INDEX IF NOT EXISTS reviews_by_user ON reviews (user_id, helpfulness, score);
+"""
+
+# Defaults if they are not set in app.config
+UNHELPFUL_MAX_HELPFULNESS = -5
+UNHELPFUL_MIN_REVIEWS = 4
+
+
+def create_reputation_indexes(db):
+    db.executescript(REPUTATION_INDEXES)
+
+
+# Review count, average helpfulness and average score of one user
+# The averages are None if the user has no reviews
+def user_stats(db, user_id):
+    return db.execute("""SELECT COUNT(*) AS num_reviews,
+                            AVG(helpfulness) AS avg_helpfulness,
+                            AVG(score) AS avg_score
+                        FROM reviews
+                        WHERE user_id = ?;""", (user_id,)).fetchone()
+
+
+# The same stats for every registered user, including those with no reviews
+def all_user_stats(db):
+    return db.execute("""SELECT u.user_id,
+                            COUNT(r.user_id) AS num_reviews,
+                            AVG(r.helpfulness) AS avg_helpfulness,
+                            AVG(r.score) AS avg_score
+                        FROM users AS u
+                        LEFT JOIN reviews AS r
+                        ON r.user_id = u.user_id
+                        GROUP BY u.user_id
+                        ORDER BY u.user_id;""").fetchall()
+
+
+# Ids of users whose reviews are consistently voted not helpful
+def find_unhelpful_users(db):
+    max_helpfulness = current_app.config.get("UNHELPFUL_MAX_HELPFULNESS", UNHELPFUL_MAX_HELPFULNESS)
+    min_reviews = current_app.config.get("UNHELPFUL_MIN_REVIEWS", UNHELPFUL_MIN_REVIEWS)
+    users = db.execute("""SELECT user_id
+                        FROM reviews
+                        GROUP BY user_id
+                        HAVING AVG(helpfulness) <= ?
+                        AND COUNT(*) >= ?
+                        ORDER BY user_id;""", (max_helpfulness, min_reviews)).fetchall()
+    return [user["user_id"] for user in users]
@@ -0,0 +1,152 @@
+"""
+Foreign keys between the tables, and deleting games, users and reviews
+
+reviews.game_id and reviews.user_id reference games and users with ON DELETE CASCADE,
+and review_votes references reviews and users the same way, so deleting a game or
+user is one DELETE and SQLite removes everything that belonged to it. The indexes
+these cascades look rows up with are reviews_by_game (pagination.py),
+reviews_by_user (reputation.py) and review_votes_by_review (votes.py).
+Every deleted review goes through the triggers in ratings.py, which take its score
+off its game's average, and deleted games are dropped from the search index by a
+trigger in search.py. A deleted game's rows in game_genres (genres.py) cascade too,
+which takes it off the genre counts.
+
+Databases made before the foreign keys existed are migrated on startup by
+create_foreign_keys, which rebuilds the tables (SQLite cannot add a foreign key to an
+existing table). Rows which already pointed at a deleted game or user are dropped, and
+how many is logged. They are dropped without going through the delete triggers, so
+when any are, the ratings, popularity and analytics made from the reviews are worked
+out again, and every change counter and user's recommendations are made stale. The migration then sets PRAGMA user_version to FOREIGN_KEYS_VERSION,
+so later starts skip it after reading one number from the database header.
+database.py turns foreign keys on for every connection.
+"""
+
+from ratings import rebuild_ratings
+from popularity import rebuild_popularity
+from analytics import rebuild_analytics
+from recommend import forget_recommendations
+from changes import bump_all_counters
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA user_version of a database whose tables have their foreign keys
+FOREIGN_KEYS_VERSION = 1
+
+# Tables with foreign keys: (name, columns copied when it is rebuilt, the new table,
+# which rows are kept), in order so each table's parents are rebuilt first
+# review_votes matches VOTES_SCHEMA in votes.py, which new databases are made with
+FOREIGN_KEY_TABLES = [
+    ("reviews", ["review_id", "user_id", "game_id", "date", "description", "score", "helpfulness"], """
+CREATE TABLE reviews_new (
+    review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT REFERENCES users (user_id) ON DELETE CASCADE,
+    game_id INTEGER REFERENCES games (game_id) ON DELETE CASCADE,
+    date DATE,
+    description TEXT,
+    score INTEGER,
+    helpfulness INTEGER DEFAULT 0
+);""", """user_id IN (SELECT user_id FROM users) AND game_id IN (SELECT game_id FROM games)"""),
+    ("review_votes", ["user_id", "review_id", "vote"], """
+CREATE TABLE review_votes_new (
+    user_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+    review_id INTEGER NOT NULL REFERENCES reviews (review_id) ON DELETE CASCADE,
+    vote INTEGER NOT NULL,
+    PRIMARY KEY (user_id, review_id)
+) WITHOUT ROWID;""", """user_id IN (SELECT user_id FROM users) AND review_id IN (SELECT review_id FROM reviews)"""),
+]
+
+
+# Rebuilds any table from FOREIGN_KEY_TABLES which does not have its foreign keys yet,
+# once for each database (see FOREIGN_KEYS_VERSION)
+# Run after the other create_* functions, so the indexes and triggers they made are kept
+# and the tables made from the reviews can be rebuilt
+# Returns how many rows were dropped
+def create_foreign_keys(db):
+    if db.execute("""PRAGMA user_version;""").fetchone()[0] >= FOREIGN_KEYS_VERSION:
+        return 0
+    missing = [table for table in FOREIGN_KEY_TABLES
+               if db.execute("""SELECT COUNT(*) FROM pragma_foreign_key_list(?);""", (table[0],)).fetchone()[0] == 0]
+    db.commit()
+    # Otherwise dropping the old tables would cascade
+    db.execute("""PRAGMA foreign_keys = OFF;""")
+    total_dropped = 0
+    try:
+        db.execute("""BEGIN IMMEDIATE;""")
+        for table, columns, create, valid in missing:
+            dropped = rebuild_table(db, table, columns, create, valid)
+            logger.warning("Added foreign keys to %s, dropped %d rows of deleted games, users or reviews",
+                           table, dropped)
+            total_dropped += dropped
+        if total_dropped > 0:
+            rebuild_ratings(db)
+            rebuild_popularity(db)
+            rebuild_analytics(db)
+            forget_recommendations(db)
+            bump_all_counters(db)
+        if db.execute("""SELECT COUNT(*) FROM pragma_foreign_key_check;""").fetchone()[0] != 0:
+            raise RuntimeError("Foreign key check failed after adding foreign keys")
+        db.execute("""PRAGMA user_version = """ + str(FOREIGN_KEYS_VERSION) + """;""")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.execute("""PRAGMA foreign_keys = ON;""")
+    return total_dropped
+
+
+# Returns how many rows were dropped because they were not valid
+def rebuild_table(db, table, columns, create, valid):
+    # The indexes and triggers on the table are dropped with it, so they are made again
+    recreate = [row["sql"] for row in db.execute("""SELECT sql FROM sqlite_master
+                                                WHERE tbl_name = ? AND type IN ('index', 'trigger')
+                                                AND sql IS NOT NULL;""", (table,))]
+    # So are triggers on other tables which may use it, which would otherwise stop the
+    # rename below as they would name a table which is not there
+    dependent = db.execute("""SELECT name, sql FROM sqlite_master
+                            WHERE type = 'trigger' AND tbl_name != ?
+                            AND sql LIKE '%' || ? || '%';""", (table, table)).fetchall()
+    for trigger in dependent:
+        db.execute("DROP TRIGGER " + trigger["name"] + ";")
+    recreate += [trigger["sql"] for trigger in dependent]
+    # In this order (https://www.sqlite.org/lang_altertable.html#otheralter), as renaming
+    # the old table would also rename the references other tables have to it
+    db.execute(create)
+    num_rows = db.execute("SELECT COUNT(*) FROM " + table + ";").fetchone()[0]
+    kept = db.execute("INSERT INTO " + table + "_new (" + ", ".join(columns) + ")"
+               + " SELECT " + ", ".join(columns) + " FROM " + table
+               + " WHERE " + valid + ";").rowcount
+    db.execute("DROP TABLE " + table + ";")
+    db.execute("ALTER TABLE " + table + "_new RENAME TO " + table + ";")
+    for sql in recreate:
+        db.execute(sql)
+    return num_rows - kept
+
+
+# The functions below delete every row whose id is in ids, and everything which
+# belonged to them, with one statement bound to a JSON array of the ids
+# Each returns the ids of the games whose pages changed, and does not commit
+
+def delete_games(db, game_ids):
+    db.execute("""DELETE FROM games WHERE game_id IN (SELECT value FROM json_each(?));""",
+               (json.dumps(list(game_ids)),))
+    return set(game_ids)
+
+
+def delete_users(db, user_ids):
+    user_ids = json.dumps(list(user_ids))
+    games = db.execute("""SELECT DISTINCT game_id FROM reviews
+                        WHERE user_id IN (SELECT value FROM json_each(?));""", (user_ids,)).fetchall()
+    db.execute("""DELETE FROM users WHERE user_id IN (SELECT value FROM json_each(?));""", (user_ids,))
+    return {game["game_id"] for game in games}
+
+
+def delete_reviews(db, review_ids):
+    review_ids = json.dumps(list(review_ids))
+    games = db.execute("""SELECT DISTINCT game_id FROM reviews
+                        WHERE review_id IN (SELECT value FROM json_each(?));""", (review_ids,)).fetchall()
+    db.execute("""DELETE FROM reviews WHERE review_id IN (SELECT value FROM json_each(?));""", (review_ids,))
+    return {game["game_id"] for game in games}
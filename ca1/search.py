@@ -0,0 +1,83 @@
+"""
+Game search for the discover page
+
+games_search is an SQLite FTS5 table using the trigram tokenizer over the
+name, developer, publisher, genre and description of every game. Its rowid is the
+game_id. Trigrams make matching case-insensitive and let a search match in the
+middle of a word, so "zeld" finds "The Legend of Zelda".
+
+The discover page pages through the games matching a search with the same keyset
+pagination and orderings as the rest of its listings (see pagination.py), so a search,
+a genre and a sort combine into one query, and a search matching every game still
+fetches one page at a time.
+
+add_game in app.py indexes a new game with index_game (which unindexes it first, so
+it can also index a game again), a trigger takes deleted games out, and bulk imports
+and "flask rebuild-search" in app.py rebuild it from scratch
+"""
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS games_search USING fts5(
+    name, developer, publisher, genre, description,
+    tokenize = 'trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS games_search_after_game_delete
+AFTER DELETE ON games
+BEGIN
+    DELETE FROM games_search WHERE rowid = OLD.game_id;
+END;
+"""
+
+# Trigrams cannot match anything shorter than 3 characters
+MIN_MATCH_LENGTH = 3
+
+def create_search_index(db):
+    db.executescript(SEARCH_SCHEMA)
+    # Fills the index the first time it is created on an existing database
+    empty = db.execute("""SELECT NOT EXISTS (SELECT 1 FROM games_search)
+                        AND EXISTS (SELECT 1 FROM games);""").fetchone()[0]
+    if empty:
+        rebuild_search_index(db)
+        db.commit()
+
+
+def rebuild_search_index(db):
+    db.execute("""DELETE FROM games_search;""")
+    db.execute("""INSERT INTO games_search (rowid, name, developer, publisher, genre, description)
+                SELECT game_id, name, developer, publisher, genre, description
+                FROM games;""")
+
+
+# Indexes the game, replacing what was indexed for it before
+def index_game(db, game_id):
+    unindex_game(db, game_id)
+    db.execute("""INSERT INTO games_search (rowid, name, developer, publisher, genre, description)
+                SELECT game_id, name, developer, publisher, genre, description
+                FROM games
+                WHERE game_id = ?;""", (game_id,))
+
+
+def unindex_game(db, game_id):
+    db.execute("""DELETE FROM games_search WHERE rowid = ?;""", (game_id,))
+
+
+# Turns what the user typed into an FTS5 phrase, so quotes and operators are matched literally
+def match_phrase(search):
+    return '"' + search.replace('"', '""') + '"'
+
+
+# Escapes LIKE wildcards for the short search fallback
+def like_prefix(search):
+    return search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+# A condition for games matching search, for the discover page's WHERE clause (see pagination.py)
+# The FTS index finds the matches, and fetch_page sorts them and returns one page
+def matching(search):
+    search = search.strip()
+    # Too short for trigrams, only match the start of the name instead
+    # LIKE is case-insensitive for ASCII in SQLite
+    if len(search) < MIN_MATCH_LENGTH:
+        return """games.name LIKE ? ESCAPE '\\'""", [like_prefix(search)]
+    return """games.game_id IN (SELECT rowid FROM games_search WHERE games_search MATCH ?)""", [match_phrase(search)]
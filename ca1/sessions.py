@@ -0,0 +1,240 @@
+"""
+Server-side sessions stored in the app database
+
+Replaces the filesystem Flask-Session store. The cookie only holds a random session
+id, and the session itself is kept as compact tagged JSON (the same format Flask
+uses for its cookie sessions) in the sessions table of app.db.
+
+Stores, chosen with app.config["SESSION_BACKEND"]:
+- "sqlite": every request reads the sessions table, and writes it when the session changed
+- "memory": sessions are kept in a dict in the worker and read without locking,
+  changes are written to the sessions table in batches every SESSION_FLUSH_INTERVAL
+  seconds (write-behind). Once it holds SESSION_MAX_ENTRIES the least recently
+  written sessions are dropped from the dict (reads do not count, so they need no
+  lock), and read from the table again if they are used. Only for single-process
+  deployments, as other processes would not see a session until it is flushed
+
+Expired sessions are swept out every SWEEP_EVERY saves, or with "flask sweep-sessions"
+
+register, login and admin_login call session.regenerate(), which moves the session to a new id
+and deletes the old one, so an id someone saw or planted before logging in is useless
+"""
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from database import read_pool, write_pool
+import atexit
+import secrets
+import threading
+import time
+
+
+SESSIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expiry REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS sessions_by_expiry ON sessions (expiry);
+"""
+
+SWEEP_EVERY = 1000
+FLUSH_INTERVAL = 2
+MAX_ENTRIES = 10000
+
+
+def create_sessions_table(db):
+    db.executescript(SESSIONS_SCHEMA)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, session_id=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.session_id = session_id
+        self.new = new
+        self.modified = False
+        # The id before regenerate(), deleted from the store when the session is saved
+        self.replaced_session_id = None
+
+    # Gives the session a new id, e.g. when the user logs in
+    def regenerate(self):
+        if not self.new and self.replaced_session_id is None:
+            self.replaced_session_id = self.session_id
+        self.session_id = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class SQLiteSessionStore:
+
+    def __init__(self):
+        self.saves = 0
+
+    # Returns (serialized session, expiry time), or None if it does not exist or has expired
+    def load(self, session_id):
+        db = read_pool.acquire()
+        try:
+            row = db.execute("""SELECT data, expiry FROM sessions
+                            WHERE session_id = ? AND expiry > ?;""", (session_id, time.time())).fetchone()
+        finally:
+            read_pool.release(db)
+        if row is None:
+            return None
+        return row["data"], row["expiry"]
+
+    def save(self, session_id, data, expiry):
+        self.save_many([(session_id, data, expiry)], [])
+
+    def delete(self, session_id):
+        self.save_many([], [session_id])
+
+    # Writes and deletes many sessions in one transaction
+    def save_many(self, saved, deleted):
+        db = write_pool.acquire()
+        try:
+            db.executemany("""INSERT INTO sessions (session_id, data, expiry)
+                            VALUES (?, ?, ?)
+                            ON CONFLICT (session_id) DO UPDATE SET
+                                data = excluded.data,
+                                expiry = excluded.expiry;""", saved)
+            db.executemany("""DELETE FROM sessions WHERE session_id = ?;""",
+                           [(session_id,) for session_id in deleted])
+            self.saves += len(saved)
+            if self.saves >= SWEEP_EVERY:
+                self.saves = 0
+                sweep_expired(db)
+            db.commit()
+        finally:
+            write_pool.release(db)
+
+
+class MemorySessionStore:
+
+    def __init__(self, backing_store, max_entries=MAX_ENTRIES, flush_interval=FLUSH_INTERVAL):
+        self.backing_store = backing_store
+        self.max_entries = max_entries
+        # session_id: (data, expiry), in the order they were last written
+        self.entries = {}
+        # session_id: (data, expiry), or None for a deleted session, waiting to be written
+        self.dirty = {}
+        self.lock = threading.Lock()
+        self.flush_interval = flush_interval
+        self.flusher = None
+        atexit.register(self.flush)
+
+    def load(self, session_id):
+        # Plain dict reads are atomic, so this needs no lock
+        entry = self.entries.get(session_id)
+        if entry is None:
+            # Deleted, but not yet flushed to the backing store
+            if session_id in self.dirty:
+                return None
+            entry = self.backing_store.load(session_id)
+            if entry is None:
+                return None
+            with self.lock:
+                self.entries.setdefault(session_id, entry)
+        if entry[1] <= time.time():
+            return None
+        return entry
+
+    def save(self, session_id, data, expiry):
+        with self.lock:
+            self.entries.pop(session_id, None)
+            self.entries[session_id] = (data, expiry)
+            self.dirty[session_id] = (data, expiry)
+            # Drops the least recently written sessions, they are still in the backing store
+            while len(self.entries) > self.max_entries:
+                oldest = next(iter(self.entries))
+                if oldest in self.dirty:
+                    break
+                del self.entries[oldest]
+        self.schedule_flush()
+
+    def delete(self, session_id):
+        with self.lock:
+            self.entries.pop(session_id, None)
+            self.dirty[session_id] = None
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flusher is None:
+            with self.lock:
+                if self.flusher is None:
+                    self.flusher = threading.Timer(self.flush_interval, self.flush)
+                    self.flusher.daemon = True
+                    self.flusher.start()
+
+    # Writes every changed session to the backing store in one transaction
+    def flush(self):
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = {}
+            self.flusher = None
+        if dirty == {}:
+            return
+        saved = [(session_id, entry[0], entry[1]) for session_id, entry in dirty.items() if entry is not None]
+        deleted = [session_id for session_id, entry in dirty.items() if entry is None]
+        self.backing_store.save_many(saved, deleted)
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        # Static files never use the session, so they skip loading it
+        if request.endpoint == "static":
+            return self.make_null_session(app)
+        session_id = request.cookies.get(self.get_cookie_name(app))
+        if session_id:
+            entry = self.store.load(session_id)
+            if entry is not None:
+                return ServerSession(self.serializer.loads(entry[0]), session_id=session_id)
+        return ServerSession(session_id=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.replaced_session_id is not None:
+            self.store.delete(session.replaced_session_id)
+        # An emptied session (e.g. after logout) is deleted along with its cookie
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.session_id)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not self.should_set_cookie(app, session):
+            return
+        expiry = time.time() + app.permanent_session_lifetime.total_seconds()
+        self.store.save(session.session_id, self.serializer.dumps(dict(session)), expiry)
+        response.set_cookie(name, session.session_id,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app),
+                            domain=domain, path=path)
+
+
+def make_session_interface(config):
+    backend_name = config.get("SESSION_BACKEND", "sqlite")
+    store = SQLiteSessionStore()
+    if backend_name == "memory":
+        store = MemorySessionStore(store,
+                                   config.get("SESSION_MAX_ENTRIES", MAX_ENTRIES),
+                                   config.get("SESSION_FLUSH_INTERVAL", FLUSH_INTERVAL))
+    elif backend_name != "sqlite":
+        raise ValueError("Unknown SESSION_BACKEND " + repr(backend_name))
+    return ServerSessionInterface(store)
+
+
+# Deletes expired sessions, returns how many were deleted
+def sweep_expired(db):
+    return db.execute("""DELETE FROM sessions WHERE expiry <= ?;""", (time.time(),)).rowcount
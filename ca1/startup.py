@@ -0,0 +1,100 @@
+"""
+Worker start up: compiled templates, a warm database and boot timings
+
+A new worker used to compile each template on the first request for it, and run its
+first queries against a cold page cache, so the first requests after a deploy, or to
+a worker added under load, were much slower than the rest.
+
+init_app gives Jinja a FileSystemBytecodeCache (in TEMPLATE_BYTECODE_DIR, or a
+folder for this user in the temp directory), so a template compiled by one worker is
+loaded from disk by the next, and precompile_templates compiles every template while
+the worker starts. warm_up runs the queries behind the home and discover pages, which
+reads the pages of their indexes into SQLite's and the OS's caches and leaves a read
+connection with its statements prepared in the pool (see database.py).
+
+The "flask data" commands are made when one of them is run (see LazyGroup), so
+workers never import bulk.py. The other optional heavy imports were already made
+only where they are used: NumPy and SciPy by recommend.build_similarity, Pillow by
+images.make_variants and brotli by assets.compress_static. Most of what is left in
+the imports step is Flask's own.
+
+mark records how long each step of start up took since the last one, and report logs
+the steps at INFO level, e.g. "Started in 310ms: imports 240ms, database 35ms, ...".
+The app's logger only shows warnings by default, so while BOOT_REPORT is on, init_app
+lets it show INFO too unless its level has been set already. Turn BOOT_REPORT off to
+start quietly. app.py imports this module first, so the imports step includes Flask's.
+"""
+
+import logging
+import time
+
+# Taken before the imports below, so they count towards the first step too
+last_mark = time.perf_counter()
+
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+from database import get_read_db
+
+
+# (step, seconds) for each step of start up so far
+boot_times = []
+
+
+def mark(step):
+    global last_mark
+    now = time.perf_counter()
+    boot_times.append((step, now - last_mark))
+    last_mark = now
+
+
+def report(app):
+    if not app.config.get("BOOT_REPORT"):
+        return
+    total = sum(seconds for step, seconds in boot_times)
+    app.logger.info("Started in %.0fms: %s", total * 1000,
+                     ", ".join("%s %.0fms" % (step, seconds * 1000) for step, seconds in boot_times))
+
+
+# Must be called before anything uses app.jinja_env, which is made on first use
+def init_app(app):
+    directory = app.config.get("TEMPLATE_BYTECODE_DIR")
+    bytecode_cache = FileSystemBytecodeCache(directory) if directory else FileSystemBytecodeCache()
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=bytecode_cache)
+    if app.config.get("BOOT_REPORT") and app.logger.level == logging.NOTSET:
+        app.logger.setLevel(logging.INFO)
+
+
+# Loads every template, compiling those not in the bytecode cache
+# Jinja keeps the loaded templates, so no request has to
+def precompile_templates(app):
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+# Runs each query(db) on a read connection, which goes back to the pool afterwards
+def warm_up(app, *queries):
+    with app.app_context():
+        db = get_read_db()
+        for query in queries:
+            query(db)
+
+
+# A group of CLI commands made by make_group() the first time one of them is used
+# (https://click.palletsprojects.com/en/stable/complex/#lazily-loading-subcommands)
+class LazyGroup(AppGroup):
+
+    def __init__(self, name, make_group, **kwargs):
+        super().__init__(name, **kwargs)
+        self.make_group = make_group
+        self.group = None
+
+    def load(self):
+        if self.group is None:
+            self.group = self.make_group()
+        return self.group
+
+    def list_commands(self, ctx):
+        return self.load().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self.load().get_command(ctx, name)
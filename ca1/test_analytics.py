@@ -0,0 +1,40 @@
+from database import write_pool
+from analytics import rebuild_analytics
+from schema import delete_reviews
+import pytest
+
+
+TABLES = ["daily_game_reviews", "daily_user_reviews", "daily_review_scores"]
+
+
+@pytest.fixture
+def db(app):
+    db = write_pool.acquire()
+    yield db
+    write_pool.release(db)
+
+
+def rollups(db):
+    return dict((table, sorted(tuple(row) for row in db.execute("SELECT * FROM " + table + ";"))) for table in TABLES)
+
+
+def test_triggers_match_a_rebuild(db):
+    db.execute("""INSERT INTO reviews (user_id, game_id, date, description, score, helpfulness)
+                VALUES ('carol', 2, '2024-05-02', 'Loud', 3, 0);""")
+    db.execute("""UPDATE reviews SET score = 7 WHERE user_id = 'bob' AND game_id = 1;""")
+    db.commit()
+    kept = rollups(db)
+    rebuild_analytics(db)
+    db.commit()
+    assert rollups(db) == kept
+
+
+def test_deleting_a_review_leaves_no_empty_rows(db):
+    db.execute("""INSERT INTO reviews (user_id, game_id, date, description, score, helpfulness)
+                VALUES ('bob', 3, '2024-07-09', 'Clever', 2, 0);""")
+    db.commit()
+    review_id = db.execute("""SELECT review_id FROM reviews WHERE user_id = 'bob' AND game_id = 3;""").fetchone()[0]
+    delete_reviews(db, [review_id])
+    db.commit()
+    for table in TABLES:
+        assert db.execute("SELECT COUNT(*) FROM " + table + " WHERE day = '2024-07-09';").fetchone()[0] == 0
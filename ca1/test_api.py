@@ -0,0 +1,51 @@
+import pytest
+
+
+@pytest.mark.parametrize("url", ["/api/v1/games", "/api/v1/games/1", "/api/v1/games/1/reviews"])
+@pytest.mark.parametrize("fields", ["", ",", " , "])
+def test_empty_fields_are_rejected(client, url, fields):
+    response = client.get(url, query_string={"fields": fields})
+    assert response.status_code == 400
+    assert "fields must name" in response.get_json()["error"]
+
+
+def test_fields_picks_the_columns(client):
+    response = client.get("/api/v1/games", query_string={"fields": "game_id, name", "order": "name"})
+    assert response.status_code == 200
+    assert response.get_json()["games"][0] == {"game_id": 2, "name": "Iron Racer"}
+
+
+def test_unknown_fields_are_rejected(client):
+    response = client.get("/api/v1/games/1", query_string={"fields": "name,password"})
+    assert response.status_code == 400
+
+
+def test_unchanged_game_is_not_modified(client):
+    etag = client.get("/api/v1/games/1").headers["ETag"]
+    response = client.get("/api/v1/games/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def counters(db):
+    return dict((row["name"], row["version"]) for row in db.execute("""SELECT name, version FROM change_counters;"""))
+
+
+def test_each_write_bumps_each_counter_once(app):
+    from database import write_pool
+    db = write_pool.acquire()
+    try:
+        before = counters(db)
+        db.execute("""INSERT INTO reviews (user_id, game_id, date, description, score, helpfulness)
+                    VALUES ('bob', 2, '2024-06-01', 'Fast', 7, 0);""")
+        db.commit()
+        after = counters(db)
+        for name in ["games", "game:2", "user:bob"]:
+            assert after[name] == before.get(name, 0) + 1
+        # A vote does not change any list of games
+        db.execute("""UPDATE reviews SET helpfulness = helpfulness + 1 WHERE user_id = 'bob' AND game_id = 2;""")
+        db.commit()
+        voted = counters(db)
+        assert voted["games"] == after["games"]
+        assert voted["game:2"] == after["game:2"] + 1
+    finally:
+        write_pool.release(db)
@@ -0,0 +1,20 @@
+from bulk import DataFileError, read_rows
+import io
+import pytest
+
+
+def test_reads_jsonl_rows():
+    file = io.StringIO('{"name": "A"}\n\n{"name": "B"}\n')
+    assert list(read_rows(file, "jsonl")) == [{"name": "A"}, {"name": "B"}]
+
+
+@pytest.mark.parametrize("line", ["[1, 2]", "3", '"name"', "null"])
+def test_rows_must_be_objects(line):
+    file = io.StringIO('{"name": "A"}\n' + line + "\n")
+    with pytest.raises(DataFileError, match="Line 2 is not a JSON object"):
+        list(read_rows(file, "jsonl"))
+
+
+def test_csv_empty_fields_are_missing():
+    file = io.StringIO("name,genre\nA,\n")
+    assert list(read_rows(file, "csv")) == [{"name": "A", "genre": None}]
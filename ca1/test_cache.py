@@ -0,0 +1,28 @@
+from cache import Cache, MemoryBackend
+
+
+def counting(calls):
+    def compute():
+        calls.append(None)
+        return len(calls)
+    return compute
+
+
+def test_invalidating_a_tag_recomputes():
+    cache = Cache(MemoryBackend())
+    calls = []
+    assert cache.get_or_set("page", ["games"], counting(calls)) == 1
+    assert cache.get_or_set("page", ["games"], counting(calls)) == 1
+    cache.invalidate("game:1")
+    assert cache.get_or_set("page", ["games"], counting(calls)) == 1
+    cache.invalidate("games")
+    assert cache.get_or_set("page", ["games"], counting(calls)) == 2
+
+
+def test_a_new_generation_recomputes():
+    generation = [1]
+    cache = Cache(MemoryBackend(), generation=lambda: generation[0], generation_interval=0)
+    calls = []
+    assert cache.get_or_set("page", [], counting(calls)) == 1
+    generation[0] = 2
+    assert cache.get_or_set("page", [], counting(calls)) == 2
@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.mark.parametrize("order", [0, 1, 2])
+def test_discover_orders(client, order):
+    assert client.get("/discover/" + str(order)).status_code == 200
+
+
+def test_discover_unknown_order_is_not_found(client):
+    assert client.get("/discover/3").status_code == 404
+
+
+def test_unreviewed_games_come_last_by_score(client, app):
+    from database import write_pool
+    db = write_pool.acquire()
+    db.execute("""INSERT INTO games (name, genre, release_date, developer, publisher, avg_score, image, description)
+                VALUES ('Empty Shelf', 'Puzzle', '2022-01-01', 'Dev', 'Pub', NULL, 'cover.png', 'Nothing yet');""")
+    db.commit()
+    write_pool.release(db)
+    names = [game["name"] for game in client.get("/api/v1/games", query_string={"order": "avg_score"}).get_json()["games"]]
+    assert names[0] == "Puzzle Kingdom"
+    assert names[-1] == "Empty Shelf"
@@ -0,0 +1,47 @@
+from database import write_pool
+from ratings import verify_ratings
+from schema import delete_games, delete_reviews
+import pytest
+
+
+@pytest.fixture
+def db(app):
+    db = write_pool.acquire()
+    yield db
+    write_pool.release(db)
+
+
+def avg_score(db, game_id):
+    return db.execute("""SELECT avg_score FROM games WHERE game_id = ?;""", (game_id,)).fetchone()[0]
+
+
+def test_triggers_keep_avg_score(db):
+    db.execute("""INSERT INTO games (name, genre, release_date, developer, publisher, avg_score, image, description)
+                VALUES ('Rating Test', 'RPG', '2020-02-02', 'Dev', 'Pub', NULL, 'cover.png', 'For ratings');""")
+    game_id = db.execute("""SELECT last_insert_rowid();""").fetchone()[0]
+    db.executemany("""INSERT INTO reviews (user_id, game_id, date, description, score, helpfulness)
+                    VALUES (?, ?, '2024-05-03', 'Rated', ?, 0);""", [("alice", game_id, 10), ("bob", game_id, 5)])
+    db.commit()
+    assert avg_score(db, game_id) == 75
+    db.execute("""UPDATE reviews SET score = 9 WHERE user_id = 'bob' AND game_id = ?;""", (game_id,))
+    db.commit()
+    assert avg_score(db, game_id) == 95
+    review_ids = [row[0] for row in db.execute("""SELECT review_id FROM reviews WHERE game_id = ?;""", (game_id,))]
+    assert delete_reviews(db, review_ids) == {game_id}
+    db.commit()
+    assert avg_score(db, game_id) is None
+    assert verify_ratings(db) == []
+
+
+def test_deleting_a_game_deletes_its_reviews(db):
+    db.execute("""INSERT INTO games (name, genre, release_date, developer, publisher, avg_score, image, description)
+                VALUES ('Doomed', 'Racing', '2020-02-02', 'Dev', 'Pub', NULL, 'cover.png', 'To be deleted');""")
+    game_id = db.execute("""SELECT last_insert_rowid();""").fetchone()[0]
+    db.execute("""INSERT INTO reviews (user_id, game_id, date, description, score, helpfulness)
+                VALUES ('carol', ?, '2024-05-04', 'Short lived', 6, 0);""", (game_id,))
+    db.commit()
+    delete_games(db, [game_id])
+    db.commit()
+    assert db.execute("""SELECT COUNT(*) FROM reviews WHERE game_id = ?;""", (game_id,)).fetchone()[0] == 0
+    assert db.execute("""SELECT COUNT(*) FROM game_ratings WHERE game_id = ?;""", (game_id,)).fetchone()[0] == 0
+    assert verify_ratings(db) == []
@@ -0,0 +1,24 @@
+from database import write_pool
+from recommend import read_scores, rebuild_recommendations
+import pytest
+
+
+@pytest.fixture
+def db(app):
+    db = write_pool.acquire()
+    yield db
+    write_pool.release(db)
+
+
+def test_scores_read_in_chunks_match(db):
+    whole = read_scores(db)
+    chunked = read_scores(db, chunk=1)
+    for one, other in zip(whole, chunked):
+        assert one.tolist() == other.tolist()
+
+
+def test_votes_do_not_rebuild(db):
+    rebuild_recommendations(db)
+    db.execute("""UPDATE reviews SET helpfulness = helpfulness + 1 WHERE game_id = 1;""")
+    db.commit()
+    assert not rebuild_recommendations(db, only_if_changed=True)
@@ -0,0 +1,66 @@
+from conftest import make_base_database
+from ratings import verify_ratings
+from popularity import rebuild_popularity
+from analytics import rebuild_analytics
+from schema import create_foreign_keys, delete_users
+import database
+import pytest
+
+
+@pytest.fixture
+def old_db(tmp_path, monkeypatch, app):
+    path = str(tmp_path / "old.db")
+    make_base_database(path)
+    monkeypatch.setattr(database, "DATABASE", path)
+    db = database.connect()
+    yield db
+    db.close()
+
+
+def rows(db, sql):
+    return sorted(tuple(row) for row in db.execute(sql))
+
+
+def test_migration_rebuilds_what_was_made_from_dropped_reviews(old_db):
+    from app import create_tables
+    # The original app deleted users without their reviews
+    old_db.execute("""DELETE FROM users WHERE user_id = 'alice';""")
+    old_db.commit()
+    create_tables(old_db)
+    assert old_db.execute("""PRAGMA user_version;""").fetchone()[0] == 1
+    assert old_db.execute("""SELECT COUNT(*) FROM reviews WHERE user_id = 'alice';""").fetchone()[0] == 0
+    assert verify_ratings(old_db) == []
+    assert old_db.execute("""SELECT avg_score FROM games WHERE game_id = 2;""").fetchone()[0] is None
+    popularity = rows(old_db, """SELECT * FROM game_popularity;""")
+    analytics = rows(old_db, """SELECT * FROM daily_game_reviews;""")
+    rebuild_popularity(old_db)
+    rebuild_analytics(old_db)
+    assert rows(old_db, """SELECT * FROM game_popularity;""") == popularity
+    assert rows(old_db, """SELECT * FROM daily_game_reviews;""") == analytics
+    # Runs once
+    assert create_foreign_keys(old_db) == 0
+
+
+def test_migration_keeps_triggers_on_other_tables(old_db):
+    from app import create_tables
+    create_tables(old_db)
+    triggers = rows(old_db, """SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'review_votes';""")
+    assert ("analytics_after_vote_insert",) in triggers
+
+
+def test_deleting_a_user_deletes_their_reviews(old_db):
+    from app import create_tables
+    create_tables(old_db)
+    assert delete_users(old_db, ["alice"]) == {1, 2}
+    old_db.commit()
+    assert old_db.execute("""SELECT COUNT(*) FROM reviews WHERE user_id = 'alice';""").fetchone()[0] == 0
+    assert verify_ratings(old_db) == []
+
+
+def test_placeholder_scores_become_null(old_db):
+    from ratings import create_ratings_tables
+    # As add_game stored a game without reviews
+    old_db.execute("""INSERT INTO games (game_id, name, avg_score) VALUES (4, 'Empty Shelf', 'None');""")
+    old_db.commit()
+    create_ratings_tables(old_db)
+    assert old_db.execute("""SELECT avg_score FROM games WHERE game_id = 4;""").fetchone()[0] is None
@@ -0,0 +1,22 @@
+import pytest
+
+
+def discovered(client, search):
+    response = client.get("/discover/1", query_string={"search": search})
+    assert response.status_code == 200
+    page = response.data.decode()
+    return [name for name in ["Star Quest", "Iron Racer", "Puzzle Kingdom"] if name in page]
+
+
+@pytest.mark.parametrize("search, names", [
+    ("uest", ["Star Quest"]),
+    ("KINGDOM", ["Puzzle Kingdom"]),
+    # Too short for trigrams, matches the start of the name
+    ("ir", ["Iron Racer"]),
+    ("e", []),
+    # Operators and quotes are matched literally
+    ('"star" OR', []),
+    ("%", []),
+])
+def test_search(client, search, names):
+    assert discovered(client, search) == names
@@ -0,0 +1,25 @@
+from conftest import USER_PASSWORD
+
+
+def session_id(client):
+    cookie = client.get_cookie("session")
+    return cookie.value if cookie is not None else None
+
+
+def test_login_rotates_the_session_id(client):
+    with client.session_transaction() as session:
+        session["visited"] = True
+    before = session_id(client)
+    response = client.post("/login", data={"user_id": "alice", "password": USER_PASSWORD})
+    assert response.status_code == 302
+    after = session_id(client)
+    assert after is not None and after != before
+    with client.session_transaction() as session:
+        assert session["user_id"] == "alice"
+        assert "visited" not in session
+
+
+def test_logout_deletes_the_session(client):
+    client.post("/login", data={"user_id": "bob", "password": USER_PASSWORD})
+    client.get("/logout")
+    assert session_id(client) is None
@@ -0,0 +1,46 @@
+import database
+import votes
+import pytest
+
+
+SCHEMA = """
+CREATE TABLE users (user_id TEXT PRIMARY KEY, password TEXT);
+CREATE TABLE games (game_id INTEGER PRIMARY KEY);
+CREATE TABLE reviews (
+    review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT REFERENCES users (user_id) ON DELETE CASCADE,
+    game_id INTEGER REFERENCES games (game_id) ON DELETE CASCADE,
+    score INTEGER,
+    helpfulness INTEGER DEFAULT 0
+);
+INSERT INTO users (user_id) VALUES ('author'), ('voter'), ('other');
+INSERT INTO games (game_id) VALUES (1);
+INSERT INTO reviews (review_id, user_id, game_id, score) VALUES (1, 'author', 1, 5);
+"""
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "app.db"))
+    pool = database.ConnectionPool()
+    db = pool.acquire()
+    db.executescript(SCHEMA)
+    votes.create_votes_table(db)
+    pool.release(db)
+    monkeypatch.setattr(votes, "write_pool", pool)
+    return pool
+
+
+def test_flush_drops_votes_of_users_deleted_while_buffered(pool):
+    buffer = votes.VoteBuffer(max_pending=100, flush_interval=60)
+    buffer.add("voter", 1, votes.HELPFUL)
+    buffer.add("other", 1, votes.HELPFUL)
+    db = pool.acquire()
+    db.execute("""DELETE FROM users WHERE user_id = 'voter';""")
+    db.commit()
+    buffer.flush()
+    assert buffer.pending == {}
+    assert buffer.flusher is None
+    assert [tuple(row) for row in db.execute("""SELECT user_id FROM review_votes;""")] == [("other",)]
+    assert db.execute("""SELECT helpfulness FROM reviews;""").fetchone()[0] == 1
+    pool.release(db)
@@ -0,0 +1,185 @@
+"""
+Helpfulness votes on reviews
+
+Each user's vote on a review is one row of review_votes (1 for helpful, -1 for not
+helpful), so a user can change their vote but never count twice, whichever device
+or session they vote from. reviews.helpfulness stays the running total and is
+moved by the difference between the old and new vote, in the same transaction
+that records the vote.
+
+Votes are not written as they are cast, but collected by a VoteBuffer (one per
+worker process) which keeps only each user's latest vote on each review, and writes
+them all with cast_votes in one transaction once VOTE_BUFFER_SIZE votes are waiting
+or VOTE_FLUSH_INTERVAL seconds have passed. The buffer is also written when the
+process exits normally, votes from its last VOTE_FLUSH_INTERVAL seconds are lost if
+it is killed. With a VOTE_FLUSH_INTERVAL of 0 (e.g. for tests) every vote is written
+before the request returns.
+A flush that fails because the database is busy is tried again with the next one, any
+other failure is logged and those votes are dropped.
+"""
+
+from database import write_pool
+import atexit
+import logging
+import sqlite3
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+VOTES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_votes (
+    user_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+    review_id INTEGER NOT NULL REFERENCES reviews (review_id) ON DELETE CASCADE,
+    vote INTEGER NOT NULL,
+    PRIMARY KEY (user_id, review_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS review_votes_by_review ON review_votes (review_id);
+"""
+
+HELPFUL = 1
+NOT_HELPFUL = -1
+
+BUFFER_SIZE = 100
+FLUSH_INTERVAL = 1
+
+
+def create_votes_table(db):
+    db.executescript(VOTES_SCHEMA)
+
+
+# Records many (user_id, review_id, vote) votes in one transaction
+# Votes on missing reviews, by users who no longer exist (deleted while their vote
+# waited in a VoteBuffer), or on the voter's own review, are ignored
+# Returns the ids of the games whose reviews' helpfulness changed
+def cast_votes(db, votes):
+    deltas = {}
+    review_games = {}
+    # Takes the write lock before reading the old votes, so two requests cannot both
+    # read the same old vote and apply their change on top of it
+    if not db.in_transaction:
+        db.execute("""BEGIN IMMEDIATE;""")
+    try:
+        for user_id, review_id, vote in votes:
+            review = db.execute("""SELECT user_id, game_id FROM reviews
+                                WHERE review_id = ?;""", (review_id,)).fetchone()
+            if review is None or review["user_id"] == user_id:
+                continue
+            voter = db.execute("""SELECT 1 FROM users WHERE user_id = ?;""", (user_id,)).fetchone()
+            if voter is None:
+                continue
+            old_vote = db.execute("""SELECT vote FROM review_votes
+                                WHERE user_id = ? AND review_id = ?;""", (user_id, review_id)).fetchone()
+            old_vote = 0 if old_vote is None else old_vote["vote"]
+            if vote == old_vote:
+                continue
+            db.execute("""INSERT INTO review_votes (user_id, review_id, vote)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT (user_id, review_id) DO UPDATE SET vote = excluded.vote;""",
+                       (user_id, review_id, vote))
+            deltas[review_id] = deltas.get(review_id, 0) + vote - old_vote
+            review_games[review_id] = review["game_id"]
+        # One update per review, however many votes it got in this batch
+        db.executemany("""UPDATE reviews
+                        SET helpfulness = helpfulness + ?
+                        WHERE review_id = ?;""",
+                       [(delta, review_id) for review_id, delta in deltas.items() if delta != 0])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {review_games[review_id] for review_id in deltas}
+
+
+# The user's votes on every review of a game, as {review_id: vote}
+def votes_for_game(db, user_id, game_id):
+    votes = db.execute("""SELECT v.review_id, v.vote
+                        FROM review_votes AS v
+                        JOIN reviews AS r
+                        ON r.review_id = v.review_id
+                        WHERE v.user_id = ?
+                        AND r.game_id = ?;""", (user_id, game_id)).fetchall()
+    return {vote["review_id"]: vote["vote"] for vote in votes}
+
+
+class VoteBuffer:
+
+    # on_flush is called with the ids of the games whose reviews' helpfulness changed
+    def __init__(self, on_flush=None, max_pending=BUFFER_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.on_flush = on_flush
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        # (user_id, review_id): vote, waiting to be written
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flusher = None
+        atexit.register(self.flush)
+
+    def add(self, user_id, review_id, vote):
+        with self.lock:
+            self.pending[(user_id, review_id)] = vote
+            full = len(self.pending) >= self.max_pending
+        if full or self.flush_interval == 0:
+            self.flush()
+        else:
+            self.schedule_flush()
+
+    # The user's votes which have not been written yet, as {review_id: vote}
+    def pending_votes(self, user_id):
+        with self.lock:
+            return {review_id: vote for (voter, review_id), vote in self.pending.items() if voter == user_id}
+
+    def schedule_flush(self):
+        if self.flusher is None:
+            with self.lock:
+                if self.flusher is None:
+                    self.flusher = threading.Timer(self.flush_interval, self.flush)
+                    self.flusher.daemon = True
+                    self.flusher.start()
+
+    # Writes every waiting vote in one transaction
+    # Only votes which failed because the database was busy are kept for the next flush,
+    # anything else would fail the same way every time and hold up every later vote
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.flusher = None
+        if pending == {}:
+            return
+        votes = [(user_id, review_id, vote) for (user_id, review_id), vote in pending.items()]
+        db = write_pool.acquire()
+        try:
+            try:
+                changed_games = cast_votes(db, votes)
+            except sqlite3.IntegrityError:
+                # Writes the votes one at a time, to drop only the ones at fault
+                changed_games = set()
+                for user_vote in votes:
+                    try:
+                        changed_games |= cast_votes(db, [user_vote])
+                    except sqlite3.IntegrityError:
+                        logger.exception("Dropped vote %r", user_vote)
+        except sqlite3.OperationalError:
+            # Kept for the next flush, unless the user has voted again since
+            logger.warning("Could not write %d votes, trying again later", len(votes), exc_info=True)
+            with self.lock:
+                for key, vote in pending.items():
+                    self.pending.setdefault(key, vote)
+            self.schedule_flush()
+            return
+        except Exception:
+            logger.exception("Dropped %d votes", len(votes))
+            return
+        finally:
+            write_pool.release(db)
+        if self.on_flush is not None and changed_games:
+            self.on_flush(changed_games)
+
+
+def make_vote_buffer(config, on_flush=None):
+    return VoteBuffer(on_flush,
+                      config.get("VOTE_BUFFER_SIZE", BUFFER_SIZE),
+                      config.get("VOTE_FLUSH_INTERVAL", FLUSH_INTERVAL))